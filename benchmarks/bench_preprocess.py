@@ -0,0 +1,100 @@
+"""Microbenchmark of the image preprocessing path across input sizes.
+
+Times each stage of web_ui's ImagePreprocessor (decode -> resize -> JPEG
+encode -> base64) on synthetic JPEG uploads of several resolutions, with
+and without reduced-resolution decoding.
+
+Run with:  python benchmarks/bench_preprocess.py --repeat 50 --output results/preprocess.json
+"""
+import argparse
+import os
+import sys
+import time
+from collections import defaultdict
+
+import cv2
+import numpy as np
+
+from common import REPO_ROOT, summarize, write_results
+
+sys.path.insert(0, os.path.join(REPO_ROOT, "web_ui"))
+
+from preprocess import RESIZE_MODES, ImagePreprocessor
+
+DEFAULT_SIZES = "640x480,1280x720,1920x1080,4032x3024"
+STAGES = ("decode", "resize", "encode", "base64")
+
+
+def synthetic_jpeg(width, height, quality=90, seed=0):
+    """A JPEG with photo-like structure (gradients plus noise) so sizes are realistic"""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    base = np.stack([x + 0 * y, y + 0 * x, (x + y) / 2], axis=-1)
+    noise = rng.normal(0, 12, (height, width, 3))
+    image = np.clip(base + noise, 0, 255).astype(np.uint8)
+    ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise RuntimeError("Failed to encode the synthetic image")
+    return encoded.tobytes()
+
+
+def run_case(data, repeat, warmup, **settings):
+    samples = defaultdict(list)
+
+    def observe(stage, seconds):
+        samples[stage].append(seconds)
+
+    preprocessor = ImagePreprocessor(observe=observe, **settings)
+    totals = []
+    payload_chars = 0
+    for iteration in range(warmup + repeat):
+        if iteration == warmup:
+            samples.clear()
+        started = time.perf_counter()
+        image = preprocessor.decode(data)
+        payload = preprocessor.encode(image)
+        if iteration >= warmup:
+            totals.append(time.perf_counter() - started)
+        payload_chars = len(payload)
+
+    result = {stage: summarize(samples[stage]) for stage in STAGES}
+    result["total"] = summarize(totals)
+    result["payload_base64_chars"] = payload_chars
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma-separated WIDTHxHEIGHT inputs")
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--target-size", type=int, default=512, help="IMAGE_SIZE sent to the model")
+    parser.add_argument("--mode", choices=RESIZE_MODES, default="fit")
+    parser.add_argument("--jpeg-quality", type=int, default=85)
+    parser.add_argument("--output", default="results/preprocess.json")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes.split(","):
+        width, height = (int(v) for v in size.lower().split("x"))
+        data = synthetic_jpeg(width, height)
+        for reduced in (False, True):
+            result = run_case(
+                data, args.repeat, args.warmup,
+                size=args.target_size, mode=args.mode,
+                jpeg_quality=args.jpeg_quality, reduced_decode=reduced,
+            )
+            results.append({"input": size, "input_bytes": len(data), "reduced_decode": reduced, **result})
+            stages = "  ".join(f"{stage} {result[stage]['p50_ms']:.2f}" for stage in STAGES)
+            print(f"{size:>10} reduced={str(reduced):5}  p50 ms: {stages}  total {result['total']['p50_ms']:.2f}")
+
+    config = {
+        "sizes": args.sizes, "repeat": args.repeat, "warmup": args.warmup,
+        "target_size": args.target_size, "mode": args.mode, "jpeg_quality": args.jpeg_quality,
+    }
+    write_results(args.output, "preprocess", config, results)
+
+
+if __name__ == "__main__":
+    main()
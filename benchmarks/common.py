@@ -0,0 +1,79 @@
+"""Shared helpers for the benchmark scripts: summaries and JSON results."""
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(ordered, p):
+    """``p``-th percentile of an already sorted list (nearest rank)"""
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def summarize(samples):
+    """Latency summary in milliseconds for a list of durations in seconds"""
+    ordered = sorted(samples)
+    if not ordered:
+        return {"count": 0}
+
+    def ms(seconds):
+        return round(seconds * 1000, 3)
+
+    return {
+        "count": len(ordered),
+        "mean_ms": ms(sum(ordered) / len(ordered)),
+        "min_ms": ms(ordered[0]),
+        "p50_ms": ms(percentile(ordered, 50)),
+        "p95_ms": ms(percentile(ordered, 95)),
+        "p99_ms": ms(percentile(ordered, 99)),
+        "max_ms": ms(ordered[-1]),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def environment():
+    import cv2
+    import numpy
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "opencv": cv2.__version__,
+        "numpy": numpy.__version__,
+    }
+
+
+def write_results(path, kind, config, results):
+    """Write one benchmark run to ``path`` as JSON, with enough context to compare runs"""
+    document = {
+        "benchmark": kind,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": git_commit(),
+        "environment": environment(),
+        "config": config,
+        "results": results,
+    }
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(document, f, indent=2)
+    print(f"Results written to {path}", file=sys.stderr)
+    return document
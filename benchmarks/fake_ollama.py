@@ -0,0 +1,253 @@
+"""Stand-in Ollama server for benchmarks and load tests.
+
+Implements the endpoints the apps use (/api/tags, /api/ps, /api/show,
+/api/generate, /api/chat) with configurable latency instead of a model:
+each generation waits ``latency`` seconds (plus ``load_time`` the first
+time a model is used after ``keep_alive`` lapsed) and then produces
+tokens at ``tokens_per_second``. Timing fields such as eval_count and
+load_duration are filled in the way Ollama reports them.
+
+Run with:  python benchmarks/fake_ollama.py --port 11435 --latency 0.2 --tokens-per-second 40
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANALYSIS_TEXT = "Age: 25-35 years\nGender: Male\nClothing: blue shirt with a dark jacket\nEnvironment: indoor office with desks and a window"
+ANALYSIS_JSON = {
+    "age": "25-35 years",
+    "gender": "Male",
+    "clothing": "blue shirt with a dark jacket",
+    "environment": "indoor office with desks and a window",
+}
+FILLER_WORDS = "the image shows a person standing near a desk in a bright room with a window behind them".split()
+
+
+def reply_text(prompt, response_tokens, structured):
+    if structured:
+        return json.dumps(ANALYSIS_JSON)
+    if "Age:" in prompt and "Environment:" in prompt:
+        return ANALYSIS_TEXT
+    return " ".join(FILLER_WORDS[i % len(FILLER_WORDS)] for i in range(response_tokens))
+
+
+def tokenize(text):
+    """Split text into word-sized tokens that join back to the original"""
+    words = text.split(" ")
+    return [word if i == len(words) - 1 else word + " " for i, word in enumerate(words)]
+
+
+class FakeOllama:
+    def __init__(self, latency=0.2, tokens_per_second=40.0, load_time=0.0, response_tokens=48,
+                 models=("llava:7b", "llama3.2:latest")):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.load_time = load_time
+        self.response_tokens = response_tokens
+        self.models = list(models)
+        self.requests = 0
+        self._loaded_until = {}
+        self._lock = threading.Lock()
+
+    def load(self, model, keep_alive):
+        """Return the load delay for ``model`` and mark it resident"""
+        seconds = parse_duration(keep_alive)
+        now = time.monotonic()
+        with self._lock:
+            self.requests += 1
+            cold = self._loaded_until.get(model, 0) < now
+            self._loaded_until[model] = now + seconds
+        return self.load_time if cold else 0.0
+
+    def loaded(self):
+        now = time.monotonic()
+        with self._lock:
+            return [model for model, until in self._loaded_until.items() if until >= now]
+
+
+def parse_duration(value):
+    """Ollama keep_alive values: seconds as a number or strings like '30m'"""
+    if value is None:
+        return 300
+    if isinstance(value, (int, float)):
+        return value
+    units = {"s": 1, "m": 60, "h": 3600}
+    if value[-1] in units:
+        return float(value[:-1]) * units[value[-1]]
+    return float(value)
+
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, body, status=200):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/api/tags":
+                self.send_json({"models": [
+                    {"name": name, "size": 4_000_000_000, "details": {
+                        "family": name.split(":")[0], "parameter_size": "7B", "quantization_level": "Q4_0",
+                    }}
+                    for name in fake.models
+                ]})
+            elif self.path == "/api/ps":
+                self.send_json({"models": [{"name": name} for name in fake.loaded()]})
+            else:
+                self.send_json({"error": "not found"}, 404)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                payload = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                self.send_json({"error": "invalid JSON"}, 400)
+                return
+
+            if self.path == "/api/show":
+                self.send_json({"model_info": {"general.architecture": "llama", "llama.context_length": 8192}})
+            elif self.path in ("/api/generate", "/api/chat"):
+                self.generate(payload, chat=self.path == "/api/chat")
+            else:
+                self.send_json({"error": "not found"}, 404)
+
+        def generate(self, payload, chat):
+            model = payload.get("model", "")
+            if model not in fake.models and f"{model}:latest" not in fake.models:
+                self.send_json({"error": f"model '{model}' not found"}, 404)
+                return
+
+            started = time.monotonic()
+            load = fake.load(model, payload.get("keep_alive"))
+            if chat:
+                prompt = " ".join(m.get("content", "") for m in payload.get("messages", []))
+            else:
+                prompt = payload.get("prompt", "")
+            if not prompt and not chat:
+                # Empty generation: Ollama only loads the model
+                time.sleep(load)
+                self.send_json(self.final(model, started, load, 0, 0, chat, done_reason="load"))
+                return
+
+            time.sleep(load + fake.latency)
+            options = payload.get("options") or {}
+            tokens = tokenize(reply_text(prompt, fake.response_tokens, bool(payload.get("format"))))
+            if options.get("num_predict", -1) >= 0:
+                tokens = tokens[:options["num_predict"]]
+            prompt_tokens = len(prompt) // 4 + 1
+            delay = 1.0 / fake.tokens_per_second if fake.tokens_per_second > 0 else 0
+
+            if not payload.get("stream", True):
+                time.sleep(delay * len(tokens))
+                body = self.final(model, started, load, prompt_tokens, len(tokens), chat)
+                self.set_text(body, "".join(tokens), chat)
+                self.send_json(body)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for token in tokens:
+                time.sleep(delay)
+                chunk = {"model": model, "done": False}
+                self.set_text(chunk, token, chat)
+                self.write_chunk(chunk)
+            final = self.final(model, started, load, prompt_tokens, len(tokens), chat)
+            self.set_text(final, "", chat)
+            self.write_chunk(final)
+            self.wfile.write(b"0\r\n\r\n")
+
+        def write_chunk(self, body):
+            data = (json.dumps(body) + "\n").encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        @staticmethod
+        def set_text(body, text, chat):
+            if chat:
+                body["message"] = {"role": "assistant", "content": text}
+            else:
+                body["response"] = text
+
+        @staticmethod
+        def final(model, started, load, prompt_tokens, eval_tokens, chat, done_reason="stop"):
+            total = time.monotonic() - started
+            eval_seconds = eval_tokens / fake.tokens_per_second if fake.tokens_per_second > 0 else 0
+            body = {
+                "model": model,
+                "done": True,
+                "done_reason": done_reason,
+                "total_duration": int(total * 1e9),
+                "load_duration": int(load * 1e9),
+                "prompt_eval_count": prompt_tokens,
+                "prompt_eval_duration": int(fake.latency * 1e9),
+                "eval_count": eval_tokens,
+                "eval_duration": int(eval_seconds * 1e9),
+            }
+            if not chat:
+                body["context"] = list(range(prompt_tokens + eval_tokens))
+            return body
+
+    return Handler
+
+
+class FakeOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients close streams early on purpose (analyses stop once every field is in)
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return
+        super().handle_error(request, client_address)
+
+
+def start(port=11435, host="127.0.0.1", **settings):
+    """Serve a FakeOllama on a background thread and return (server, fake)"""
+    fake = FakeOllama(**settings)
+    server = FakeOllamaServer((host, port), make_handler(fake))
+    threading.Thread(target=server.serve_forever, name="fake-ollama", daemon=True).start()
+    return server, fake
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=40.0)
+    parser.add_argument("--load-time", type=float, default=0.0, help="extra delay when the model is cold")
+    parser.add_argument("--response-tokens", type=int, default=48, help="length of free-form replies")
+    parser.add_argument("--models", default="llava:7b,llama3.2:latest")
+    args = parser.parse_args()
+
+    server, _ = start(
+        args.port, args.host,
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        load_time=args.load_time,
+        response_tokens=args.response_tokens,
+        models=[m.strip() for m in args.models.split(",") if m.strip()],
+    )
+    print(f"Fake Ollama listening on http://{args.host}:{args.port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""Concurrent load generator for the scene analyzer and the chatbot.
+
+Each worker thread plays one client (its own HTTP session and
+X-Client-ID) and sends requests back to back until the request budget or
+duration runs out. Reports p50/p95/p99 latency, time to first token for
+streaming targets, requests/sec and status counts.
+
+Targets:
+  analyze, analyze-stream   POST an image to /analyze or /analyze/stream
+  chat, chat-stream         ask about an image session opened with /analyze
+  chatbot                   drive chat_bot's chat_with_ollama in-process
+                            (needs gradio installed; --ollama-url selects the server)
+
+Run with:  python benchmarks/load_test.py --url http://127.0.0.1:5000 --target analyze --concurrency 8 --requests 200
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+import requests
+
+from bench_preprocess import synthetic_jpeg
+from common import REPO_ROOT, summarize, write_results
+
+TARGETS = ("analyze", "analyze-stream", "chat", "chat-stream", "chatbot")
+CHAT_QUESTIONS = (
+    "What is the person wearing?",
+    "Describe the background.",
+    "Is this indoors or outdoors?",
+    "What time of day does it look like?",
+)
+
+
+class Budget:
+    """Hands out request slots until a count or a deadline is reached"""
+
+    def __init__(self, requests=None, duration=None):
+        self.remaining = requests
+        self.deadline = time.monotonic() + duration if duration else None
+        self._lock = threading.Lock()
+
+    def take(self):
+        with self._lock:
+            if self.deadline is not None and time.monotonic() >= self.deadline:
+                return False
+            if self.remaining is not None:
+                if self.remaining <= 0:
+                    return False
+                self.remaining -= 1
+            return True
+
+
+def read_first_event(response):
+    """Consume an SSE response, returning (seconds to first token, error event seen)"""
+    started = time.perf_counter()
+    first_token = None
+    error = False
+    event = None
+    for line in response.iter_lines(decode_unicode=True):
+        if line.startswith("event: "):
+            event = line[7:]
+            if event in ("token", "field") and first_token is None:
+                first_token = time.perf_counter() - started
+            elif event == "error":
+                error = True
+    return first_token, error
+
+
+class HttpClient:
+    """One simulated browser: a session, a client ID and (for chat) an image session"""
+
+    def __init__(self, url, target, images, index):
+        self.url = url.rstrip("/")
+        self.target = target
+        self.images = images
+        self.index = index
+        self.session = requests.Session()
+        self.session.headers["X-Client-ID"] = f"load-{index}-{uuid.uuid4().hex[:6]}"
+        self.image_id = None
+        self.count = 0
+
+    def next_image(self):
+        self.count += 1
+        return self.images[(self.index + self.count * 7) % len(self.images)]
+
+    def open_session(self):
+        response = self.session.post(f"{self.url}/analyze", files={"image": ("frame.jpg", self.next_image(), "image/jpeg")})
+        response.raise_for_status()
+        self.image_id = response.json()["image_id"]
+
+    def request(self):
+        """Send one request, returning (status, seconds to first token or None)"""
+        if self.target in ("analyze", "analyze-stream"):
+            path = "/analyze/stream" if self.target == "analyze-stream" else "/analyze"
+            kwargs = {"files": {"image": ("frame.jpg", self.next_image(), "image/jpeg")}}
+        else:
+            if self.image_id is None:
+                self.open_session()
+            path = "/chat/stream" if self.target == "chat-stream" else "/chat"
+            kwargs = {"data": {"image_id": self.image_id, "message": CHAT_QUESTIONS[self.count % len(CHAT_QUESTIONS)]}}
+            self.count += 1
+
+        stream = self.target.endswith("-stream")
+        response = self.session.post(f"{self.url}{path}", stream=stream, **kwargs)
+        with response:
+            if stream and response.status_code == 200:
+                first_token, error = read_first_event(response)
+                return ("stream_error" if error else 200), first_token
+            response.content
+            if response.status_code == 404 and self.image_id is not None:
+                self.image_id = None  # session expired, open a new one next time
+            return response.status_code, None
+
+
+class ChatbotClient:
+    """One chatbot conversation driven through chat_with_ollama"""
+
+    def __init__(self, model):
+        import ollama_chatbot_gradio as chatbot
+
+        self.chatbot = chatbot
+        self.model = model
+        self.history = []
+        self.memory = None
+        self.count = 0
+
+    def request(self):
+        message = CHAT_QUESTIONS[self.count % len(CHAT_QUESTIONS)]
+        self.count += 1
+        started = time.perf_counter()
+        first_token = None
+        for history, _, _, memory in self.chatbot.chat_with_ollama(message, self.history, self.model, self.memory):
+            if first_token is None and history[-1][1]:
+                first_token = time.perf_counter() - started
+            self.history, self.memory = history, memory
+        reply = self.history[-1][1]
+        return ("error" if reply.startswith(("❌", "⚠️")) else 200), first_token
+
+
+def run_load(target, url=None, concurrency=4, requests=100, duration=None, distinct_images=32,
+             image_size=(1280, 720), model="llama3.2"):
+    """Run one load test and return its summary"""
+    if target == "chatbot":
+        sys.path.insert(0, os.path.join(REPO_ROOT, "chat_bot"))
+        clients = [ChatbotClient(model) for _ in range(concurrency)]
+    else:
+        images = [synthetic_jpeg(*image_size, seed=seed) for seed in range(distinct_images)]
+        clients = [HttpClient(url, target, images, index) for index in range(concurrency)]
+
+    budget = Budget(requests, duration)
+    latencies, first_tokens, statuses = [], [], Counter()
+    lock = threading.Lock()
+
+    def worker(client):
+        while budget.take():
+            started = time.perf_counter()
+            try:
+                status, first_token = client.request()
+            except Exception as e:
+                status, first_token = type(e).__name__, None
+            elapsed = time.perf_counter() - started
+            with lock:
+                statuses[str(status)] += 1
+                if status == 200:
+                    latencies.append(elapsed)
+                    if first_token is not None:
+                        first_tokens.append(first_token)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(client,), daemon=True) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    completed = sum(statuses.values())
+    return {
+        "target": target,
+        "concurrency": concurrency,
+        "completed": completed,
+        "succeeded": len(latencies),
+        "statuses": dict(statuses),
+        "duration_s": round(wall, 3),
+        "requests_per_second": round(completed / wall, 3) if wall else None,
+        "successes_per_second": round(len(latencies) / wall, 3) if wall else None,
+        "latency": summarize(latencies),
+        "first_token": summarize(first_tokens) if first_tokens else None,
+    }
+
+
+def print_summary(summary):
+    latency = summary["latency"]
+    line = (f"{summary['target']:>14} c={summary['concurrency']:<3} {summary['completed']} requests "
+            f"in {summary['duration_s']:.1f}s  {summary['requests_per_second']:.1f} req/s")
+    if latency["count"]:
+        line += f"  p50 {latency['p50_ms']:.0f}ms  p95 {latency['p95_ms']:.0f}ms  p99 {latency['p99_ms']:.0f}ms"
+    if summary["first_token"]:
+        line += f"  first token p50 {summary['first_token']['p50_ms']:.0f}ms"
+    print(line)
+    print(f"{'':>14} statuses: {summary['statuses']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="scene analyzer base URL")
+    parser.add_argument("--target", choices=TARGETS, default="analyze")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=100, help="total requests (ignored with --duration)")
+    parser.add_argument("--duration", type=float, default=None, help="run for this many seconds instead")
+    parser.add_argument("--distinct-images", type=int, default=32,
+                        help="size of the image pool; the result cache serves repeats")
+    parser.add_argument("--image-size", default="1280x720")
+    parser.add_argument("--model", default="llama3.2", help="chatbot target: Ollama model")
+    parser.add_argument("--ollama-url", default=None, help="chatbot target: sets OLLAMA_BACKENDS")
+    parser.add_argument("--output", default=None, help="JSON results file (default results/load-<target>.json)")
+    args = parser.parse_args()
+
+    if args.ollama_url:
+        os.environ["OLLAMA_BACKENDS"] = args.ollama_url
+    width, height = (int(v) for v in args.image_size.lower().split("x"))
+    summary = run_load(
+        args.target, args.url, args.concurrency,
+        requests=None if args.duration else args.requests,
+        duration=args.duration,
+        distinct_images=args.distinct_images,
+        image_size=(width, height),
+        model=args.model,
+    )
+    print_summary(summary)
+    config = {key: value for key, value in vars(args).items() if key != "output"}
+    write_results(args.output or f"results/load-{args.target}.json", "load", config, [summary])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Run the whole benchmark suite against a fake Ollama server.
+
+Starts benchmarks/fake_ollama.py in-process, launches web_ui (Flask or the
+ASGI server) pointed at it, then runs the preprocessing microbenchmark and
+load tests for /analyze and /chat, plus the chatbot when gradio is
+installed. Everything lands in one JSON file so runs can be diffed.
+
+Run with:  python benchmarks/run.py --server asgi --concurrency 1,4,16 --output results/run.json
+"""
+import argparse
+import importlib.util
+import os
+import subprocess
+import sys
+import time
+
+import requests
+
+import fake_ollama
+from bench_preprocess import DEFAULT_SIZES, STAGES, run_case, synthetic_jpeg
+from common import REPO_ROOT, write_results
+from load_test import print_summary, run_load
+
+WEB_UI = os.path.join(REPO_ROOT, "web_ui")
+
+
+def start_server(kind, port, ollama_url, extra_env):
+    env = dict(os.environ)
+    env.update({
+        "OLLAMA_BACKENDS": ollama_url,
+        "KEEPALIVE_HOURS": "",
+        "LOG_LEVEL": "WARNING",
+        **extra_env,
+    })
+    if kind == "flask":
+        command = [sys.executable, "-m", "flask", "--app", "app", "run", "--port", str(port), "--no-reload"]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "asgi_app:app", "--port", str(port), "--log-level", "warning"]
+    process = subprocess.Popen(command, cwd=WEB_UI, env=env)
+
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        if process.poll() is not None:
+            raise RuntimeError(f"{kind} server exited with code {process.returncode}")
+        try:
+            requests.get(f"{url}/backends/stats", timeout=1)
+            return process, url
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"{kind} server did not come up on {url}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--server", choices=("flask", "asgi"), default="asgi")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--ollama-port", type=int, default=11435)
+    parser.add_argument("--latency", type=float, default=0.2, help="fake Ollama: seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=40.0)
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated levels for each load test")
+    parser.add_argument("--requests", type=int, default=64, help="requests per load test")
+    parser.add_argument("--targets", default="analyze,analyze-stream,chat,chat-stream,chatbot")
+    parser.add_argument("--num-parallel", type=int, default=4, help="OLLAMA_NUM_PARALLEL for the server")
+    parser.add_argument("--preprocess-repeat", type=int, default=20)
+    parser.add_argument("--output", default="results/run.json")
+    args = parser.parse_args()
+
+    fake_server, _ = fake_ollama.start(args.ollama_port, latency=args.latency, tokens_per_second=args.tokens_per_second)
+    ollama_url = f"http://127.0.0.1:{args.ollama_port}"
+    results = {"preprocess": [], "load": []}
+
+    print("== Preprocessing")
+    for size in DEFAULT_SIZES.split(","):
+        width, height = (int(v) for v in size.split("x"))
+        result = run_case(synthetic_jpeg(width, height), args.preprocess_repeat, 3)
+        results["preprocess"].append({"input": size, **result})
+        print(f"{size:>10}  p50 ms: " + "  ".join(f"{stage} {result[stage]['p50_ms']:.2f}" for stage in STAGES))
+
+    targets = [t.strip() for t in args.targets.split(",") if t.strip()]
+    if "chatbot" in targets and importlib.util.find_spec("gradio") is None:
+        print("gradio is not installed, skipping the chatbot target")
+        targets.remove("chatbot")
+
+    print(f"== Load ({args.server})")
+    # A disabled result cache keeps every request on the Ollama path
+    process, url = start_server(args.server, args.port, ollama_url, {
+        "OLLAMA_NUM_PARALLEL": str(args.num_parallel),
+        "OLLAMA_MAX_INFLIGHT": str(args.num_parallel),
+        "RESULT_CACHE_SIZE": "0",
+    })
+    try:
+        for target in targets:
+            if target == "chatbot":
+                os.environ["OLLAMA_BACKENDS"] = ollama_url
+            for concurrency in (int(c) for c in args.concurrency.split(",")):
+                summary = run_load(target, url, concurrency, requests=args.requests, distinct_images=args.requests)
+                print_summary(summary)
+                results["load"].append(summary)
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+        fake_server.shutdown()
+
+    write_results(args.output, "suite", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Token-budgeted conversation memory for the Ollama chat mode.
+
+While a conversation fits in the model's context budget, each turn sends
+only the new message together with the ``context`` tokens Ollama returned
+for the previous turn, so the server continues from its cached state
+instead of re-reading the whole transcript. When the next turn would not
+fit (or the context is missing or stale), older turns are folded into a
+rolling summary and a fresh prompt is built from that summary plus the
+most recent turns.
+"""
+
+# Rough average for English text with the Llama-family tokenizers
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def format_turns(turns):
+    return "".join(f"You: {user_msg}\nBot: {bot_msg}\n" for user_msg, bot_msg in turns)
+
+
+class ConversationMemory:
+    """Per-session state: Ollama context tokens plus a rolling summary"""
+
+    def __init__(self, budget, reply_tokens=512, keep_turns=4):
+        self.budget = budget
+        self.reply_tokens = reply_tokens
+        self.keep_turns = keep_turns
+        self.summary = ""
+        self.summarized = 0  # history turns folded into the summary
+        self.model = None
+        self.context = None
+        self.turns = 0  # history turns covered by ``context``
+
+    def can_continue(self, model, turns, message):
+        """Whether the next turn can extend the previous Ollama context"""
+        if self.context is None or model != self.model or turns != self.turns:
+            return False
+        return len(self.context) + estimate_tokens(message) + self.reply_tokens <= self.budget
+
+    def remember(self, model, context, turns):
+        self.model = model
+        self.context = context
+        self.turns = turns
+
+    def split(self, history, message):
+        """Return (turns to fold into the summary, turns to replay verbatim)"""
+        if self.summarized > len(history):
+            self.summary, self.summarized = "", 0
+
+        # A rebuilt prompt only gets half the budget, so the following turns
+        # can extend its context for a while before the next rollover
+        available = (self.budget // 2 - self.reply_tokens
+                     - estimate_tokens(self.summary) - estimate_tokens(message))
+        start = max(self.summarized, len(history) - self.keep_turns)
+        while start < len(history) and estimate_tokens(format_turns(history[start:])) > available:
+            start += 1
+        return history[self.summarized:start], history[start:]
+
+    def summary_prompt(self, turns):
+        previous = f"Summary so far:\n{self.summary}\n\n" if self.summary else ""
+        return (
+            f"{previous}Conversation:\n{format_turns(turns)}\n"
+            "Update the summary so it keeps the facts, names, decisions and open questions "
+            "from the conversation above. Reply with the summary only, in a few sentences."
+        )
+
+    def add_summary(self, summary, turns):
+        """Replace the summary with one that also covers ``turns`` more history turns"""
+        self.summary = summary
+        self.summarized += turns
+
+    def prompt(self, recent, message):
+        """Full prompt for a fresh context: summary, recent turns, new message"""
+        summary = f"Summary of the earlier conversation: {self.summary}\n\n" if self.summary else ""
+        return f"{summary}{format_turns(recent)}You: {message}\nBot:"
+
+    @staticmethod
+    def continuation(message):
+        """Prompt for a turn that extends the previous context"""
+        return f"You: {message}\nBot:"
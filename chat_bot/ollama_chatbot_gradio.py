@@ -1,70 +1,207 @@
+import json
+import logging
+import os
+import sys
+import threading
+
 import gradio as gr
-import requests
 import google.generativeai as genai
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from conversation_memory import ConversationMemory
+from ollama_backends import (
+    BackendPool,
+    KeepAlivePinger,
+    ModelRegistry,
+    NoBackendAvailable,
+    log_generation_timing,
+    normalize_model,
+)
+
+logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s')
+
 # Configuration
 OLLAMA_API_URL = "http://localhost:11434/api/generate"
 DEFAULT_OLLAMA_MODEL = "llama3.2"
 GEMINI_API_KEY = "_________________"
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")  # how long Ollama keeps a model loaded after a request
+
+# Conversation memory: context window, room left for the reply, and
+# how many recent turns are replayed verbatim after a summary rollover
+CHAT_NUM_CTX = int(os.getenv("CHAT_NUM_CTX", "4096"))
+CHAT_REPLY_TOKENS = int(os.getenv("CHAT_REPLY_TOKENS", "512"))
+CHAT_KEEP_TURNS = int(os.getenv("CHAT_KEEP_TURNS", "4"))
+model_budgets = {}
+
+# Streaming events Gradio runs at once; the default of 1 would make every
+# user wait for the previous reply to finish streaming
+CHAT_CONCURRENCY = int(os.getenv("CHAT_CONCURRENCY", "8"))
+CHAT_QUEUE_SIZE = int(os.getenv("CHAT_QUEUE_SIZE", "64"))
+
+# Ollama servers to balance across (OLLAMA_BACKENDS, comma-separated)
+ollama_backends = BackendPool.from_env(default_url=OLLAMA_API_URL)
+ollama_backends.start_health_checks()
+
+# Model list for the dropdown; re-probed in the background once older than the TTL
+MODEL_REGISTRY_TTL = float(os.getenv("MODEL_REGISTRY_TTL", "60"))
+model_registry = ModelRegistry(ollama_backends, ttl=MODEL_REGISTRY_TTL)
 
 # Initialize Gemini API
 genai.configure(api_key=GEMINI_API_KEY)
 gemini_model = genai.GenerativeModel("gemini-1.5-flash")
 
-def chat_with_ollama(message, chat_history, model_name):
-    """Chat with Ollama local model"""
-    # Build prompt using chat history
-    prompt = ""
-    for user_msg, bot_msg in chat_history:
-        prompt += f"You: {user_msg}\nBot: {bot_msg}\n"
-    prompt += f"You: {message}\nBot:"
+def ollama_post(model_name, path, payload, timeout=30):
+    """POST to the least-loaded Ollama backend that has ``model_name``"""
+    backend = ollama_backends.acquire(model_name)
+    success = False
+    try:
+        response = ollama_backends.session.post(f"{backend.url}{path}", json=payload, timeout=timeout)
+        # Only server-side failures count against the backend's health
+        success = response.status_code < 500 and response.status_code != 404
+        return response
+    finally:
+        ollama_backends.release(backend, success)
+
+def context_budget(model_name):
+    """Context window to use for a model: CHAT_NUM_CTX, capped by what the model supports"""
+    if model_name not in model_budgets:
+        budget = CHAT_NUM_CTX
+        try:
+            response = ollama_post(model_name, "/api/show", {"model": model_name}, timeout=10)
+            if response.status_code == 200:
+                for key, value in response.json().get("model_info", {}).items():
+                    if key.endswith(".context_length"):
+                        budget = min(budget, int(value))
+        except Exception:
+            pass  # fall back to CHAT_NUM_CTX
+        model_budgets[model_name] = budget
+    return model_budgets[model_name]
 
+def summarize_turns(memory, turns, model_name):
+    """Fold ``turns`` into the session's rolling summary"""
     try:
-        response = requests.post(OLLAMA_API_URL, json={
+        response = ollama_post(model_name, "/api/generate", {
             "model": model_name,
-            "prompt": prompt,
-            "stream": False
-        }, timeout=30)
-
+            "prompt": memory.summary_prompt(turns),
+            "stream": False,
+            "keep_alive": OLLAMA_KEEP_ALIVE,
+            "options": {"num_ctx": memory.budget, "num_predict": memory.reply_tokens}
+        })
         if response.status_code == 200:
-            bot_reply = response.json()["response"].strip()
-        else:
-            bot_reply = f"⚠️ Error from Ollama: {response.text}"
-    except Exception as e:
+            memory.add_summary(response.json()["response"].strip(), len(turns))
+    except Exception:
+        pass  # keep the old summary; the turns are retried on the next rollover
+
+def chat_with_ollama(message, chat_history, model_name, memory=None):
+    """Chat with Ollama local model"""
+    if memory is None:
+        memory = ConversationMemory(context_budget(model_name), CHAT_REPLY_TOKENS, CHAT_KEEP_TURNS)
+
+    # Show the user's message right away; the reply fills in as tokens arrive
+    previous_turns = list(chat_history)
+    chat_history.append((message, ""))
+    yield chat_history, chat_history, "", memory
+
+    if memory.can_continue(model_name, len(previous_turns), message):
+        # Extend the previous turn's context: only the new message is evaluated
+        payload = {"prompt": memory.continuation(message), "context": memory.context}
+    else:
+        memory.budget = context_budget(model_name)
+        older, recent = memory.split(previous_turns, message)
+        if older:
+            summarize_turns(memory, older, model_name)
+        payload = {"prompt": memory.prompt(recent, message)}
+
+    bot_reply = ""
+    try:
+        backend = ollama_backends.acquire(model_name)
+    except NoBackendAvailable as e:
         bot_reply = f"❌ Could not connect to Ollama: {e}"
+    else:
+        success = False
+        try:
+            with ollama_backends.session.post(f"{backend.url}/api/generate", json={
+                "model": model_name,
+                "stream": True,
+                "keep_alive": OLLAMA_KEEP_ALIVE,
+                "options": {"num_ctx": memory.budget},
+                **payload
+            }, stream=True, timeout=30) as response:
+                # Only server-side failures count against the backend's health
+                success = response.status_code < 500 and response.status_code != 404
+                if response.status_code != 200:
+                    bot_reply = f"⚠️ Error from Ollama: {response.text}"
+                else:
+                    for line in response.iter_lines():
+                        if not line:
+                            continue
+                        chunk = json.loads(line)
+                        if chunk.get("error"):
+                            bot_reply += f"\n⚠️ Error from Ollama: {chunk['error']}"
+                            break
+                        if chunk.get("response"):
+                            bot_reply += chunk["response"]
+                            chat_history[-1] = (message, bot_reply)
+                            yield chat_history, chat_history, "", memory
+                        if chunk.get("done"):
+                            log_generation_timing(model_name, chunk, backend.url)
+                            memory.remember(model_name, chunk.get("context"), len(chat_history))
+        except Exception as e:
+            bot_reply = f"❌ Could not connect to Ollama: {e}"
+        finally:
+            ollama_backends.release(backend, success)
 
-    chat_history.append((message, bot_reply))
-    return chat_history, chat_history, ""
+    chat_history[-1] = (message, bot_reply.strip())
+    yield chat_history, chat_history, "", memory
 
 def chat_with_gemini(message, chat_history):
     """Chat with Gemini API"""
+    # Build context from chat history
+    context = ""
+    for user_msg, bot_msg in chat_history[-3:]:  # Keep last 3 exchanges for context
+        context += f"Human: {user_msg}\nAssistant: {bot_msg}\n"
+
+    full_prompt = f"{context}Human: {message}\nAssistant:"
+
+    chat_history.append((message, ""))
+    yield chat_history, chat_history, ""
+
+    bot_reply = ""
     try:
-        # Build context from chat history
-        context = ""
-        for user_msg, bot_msg in chat_history[-3:]:  # Keep last 3 exchanges for context
-            context += f"Human: {user_msg}\nAssistant: {bot_msg}\n"
-        
-        full_prompt = f"{context}Human: {message}\nAssistant:"
-        
-        response = gemini_model.generate_content(full_prompt)
-        bot_reply = response.text.strip()
-        
+        for chunk in gemini_model.generate_content(full_prompt, stream=True):
+            bot_reply += chunk.text
+            chat_history[-1] = (message, bot_reply)
+            yield chat_history, chat_history, ""
     except Exception as e:
         bot_reply = f"❌ Gemini API Error: {str(e)}"
 
-    chat_history.append((message, bot_reply))
-    return chat_history, chat_history, ""
+    chat_history[-1] = (message, bot_reply.strip())
+    yield chat_history, chat_history, ""
 
-def get_ollama_models():
-    """Get available Ollama models"""
-    try:
-        response = requests.get("http://localhost:11434/api/tags", timeout=5)
-        if response.status_code == 200:
-            models = response.json().get("models", [])
-            return [model["name"] for model in models] if models else [DEFAULT_OLLAMA_MODEL]
-    except:
-        pass
-    return [DEFAULT_OLLAMA_MODEL]
+def model_label(info):
+    """Dropdown label for a model, e.g. 'llama3.2:latest · 2.0 GB · Q4_K_M · 🔥 loaded'"""
+    parts = [info["name"]]
+    if info.get("size"):
+        parts.append(f"{info['size'] / 1e9:.1f} GB")
+    if info.get("quantization"):
+        parts.append(info["quantization"])
+    if info["loaded"]:
+        parts.append("🔥 loaded")
+    return " · ".join(parts)
+
+def model_dropdown(selected=None, refresh=False):
+    """Dropdown update listing known models, preferring ones already loaded"""
+    catalog = model_registry.refresh() if refresh else model_registry.catalog()
+    if not catalog:
+        return gr.update(choices=[DEFAULT_OLLAMA_MODEL], value=selected or DEFAULT_OLLAMA_MODEL)
+
+    names = [info["name"] for info in catalog]
+    if selected and normalize_model(selected) in names:
+        selected = normalize_model(selected)
+    else:
+        selected = names[0]  # the catalog lists warm models first
+    return gr.update(choices=[(model_label(info), info["name"]) for info in catalog], value=selected)
 
 # ---------------- UI ---------------- #
 with gr.Blocks(theme=gr.themes.Soft(), title="AI Chatbot") as demo:
@@ -83,12 +220,14 @@ with gr.Blocks(theme=gr.themes.Soft(), title="AI Chatbot") as demo:
             label="Select AI Mode"
         )
         
+        # Filled in on page load so building the UI never waits on Ollama
         ollama_model = gr.Dropdown(
-            choices=get_ollama_models(),
+            choices=[DEFAULT_OLLAMA_MODEL],
             value=DEFAULT_OLLAMA_MODEL,
             label="Ollama Model",
             visible=True
         )
+        refresh_models_btn = gr.Button("🔄 Refresh Models", scale=0)
     
     # Status
     status = gr.Markdown("**Status:** 🤖 Ollama mode selected")
@@ -109,45 +248,62 @@ with gr.Blocks(theme=gr.themes.Soft(), title="AI Chatbot") as demo:
     
     # State
     chat_state = gr.State([])
+    memory_state = gr.State(None)
     
     # Functions
     def update_status(mode):
         if mode == "🤖 Ollama (Local)":
-            return "**Status:** 🤖 Ollama mode selected", gr.update(visible=True)
+            return "**Status:** 🤖 Ollama mode selected", gr.update(visible=True), gr.update(visible=True)
         else:
-            return "**Status:** 🌟 Gemini mode selected", gr.update(visible=False)
+            return "**Status:** 🌟 Gemini mode selected", gr.update(visible=False), gr.update(visible=False)
     
-    def process_chat(message, history, mode, model):
+    def process_chat(message, history, memory, mode, model):
         if not message.strip():
-            return history, history, ""
+            yield history, history, "", memory
+            return
         
         if mode == "🤖 Ollama (Local)":
-            return chat_with_ollama(message, history, model)
+            yield from chat_with_ollama(message, history, model, memory)
         else:
-            return chat_with_gemini(message, history)
+            # Gemini turns are not in the Ollama context; the turn count
+            # mismatch makes the next Ollama turn rebuild its prompt
+            for update in chat_with_gemini(message, history):
+                yield (*update, memory)
     
     # Events
     mode_selector.change(
         update_status,
         inputs=[mode_selector],
-        outputs=[status, ollama_model]
+        outputs=[status, ollama_model, refresh_models_btn]
+    )
+    
+    refresh_models_btn.click(
+        lambda selected: model_dropdown(selected, refresh=True),
+        inputs=[ollama_model],
+        outputs=[ollama_model]
+    )
+    
+    demo.load(
+        model_dropdown,
+        inputs=[ollama_model],
+        outputs=[ollama_model]
     )
     
     user_input.submit(
         process_chat,
-        inputs=[user_input, chat_state, mode_selector, ollama_model],
-        outputs=[chatbot, chat_state, user_input]
+        inputs=[user_input, chat_state, memory_state, mode_selector, ollama_model],
+        outputs=[chatbot, chat_state, user_input, memory_state]
     )
     
     send_btn.click(
         process_chat,
-        inputs=[user_input, chat_state, mode_selector, ollama_model],
-        outputs=[chatbot, chat_state, user_input]
+        inputs=[user_input, chat_state, memory_state, mode_selector, ollama_model],
+        outputs=[chatbot, chat_state, user_input, memory_state]
     )
     
     clear_btn.click(
-        lambda: ([], []),
-        outputs=[chatbot, chat_state]
+        lambda: ([], [], None),
+        outputs=[chatbot, chat_state, memory_state]
     )
     
     gr.HTML("""
@@ -156,7 +312,16 @@ with gr.Blocks(theme=gr.themes.Soft(), title="AI Chatbot") as demo:
     </div>
     """)
 
+demo.queue(default_concurrency_limit=CHAT_CONCURRENCY, max_size=CHAT_QUEUE_SIZE)
+
 # Run the application
 if __name__ == "__main__":
     print("🚀 Starting AI Chatbot...")
+    # Load the default model in the background so the UI comes up right away
+    threading.Thread(
+        target=ollama_backends.warm_up, args=(DEFAULT_OLLAMA_MODEL, OLLAMA_KEEP_ALIVE), daemon=True
+    ).start()
+    pinger = KeepAlivePinger.from_env(ollama_backends, DEFAULT_OLLAMA_MODEL, OLLAMA_KEEP_ALIVE)
+    if pinger is not None:
+        pinger.start()
     demo.launch(share=True)
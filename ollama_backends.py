@@ -0,0 +1,470 @@
+"""Routing across one or more Ollama servers, shared by web_ui and chat_bot.
+
+Requests go to the healthy backend with the fewest outstanding requests
+among those that have the requested model, taking turns between backends
+that tie. A background thread probes
+every backend's /api/tags (and /api/ps for resident models); a backend
+that fails ``failure_threshold`` times in a row is taken out of rotation
+for ``cooldown`` seconds, after which a single trial request or probe may
+close the circuit again.
+
+ModelRegistry serves the merged model list (with size, quantization and
+whether the model is loaded) from that probe data without blocking.
+warm_up and KeepAlivePinger preload a model and keep it resident so
+requests do not pay the model-load cost. RetryPolicy and LatencyTracker
+hold the deadline, backoff and hedging settings used by the callers'
+retry loops.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import requests
+
+
+# Statuses worth retrying; any other 4xx will fail the same way again
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+# A generation whose load_duration exceeds this had to load the model first
+COLD_LOAD_SECONDS = 0.5
+
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+
+class NoBackendAvailable(Exception):
+    """Raised when no backend can currently serve the requested model"""
+
+
+class RetryPolicy:
+    """Deadline-bounded retries with exponential backoff and full jitter"""
+
+    def __init__(self, deadline=90, connect_timeout=3.05, read_timeout=30,
+                 base_delay=0.5, max_delay=8, max_attempts=3, hedge_percentile=0):
+        self.deadline = deadline
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.hedge_percentile = hedge_percentile  # 0 disables hedged requests
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            deadline=float(os.getenv("OLLAMA_DEADLINE", "90")),
+            connect_timeout=float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "3.05")),
+            read_timeout=float(os.getenv("OLLAMA_READ_TIMEOUT", "30")),
+            base_delay=float(os.getenv("OLLAMA_RETRY_BASE_DELAY", "0.5")),
+            max_delay=float(os.getenv("OLLAMA_RETRY_MAX_DELAY", "8")),
+            max_attempts=int(os.getenv("OLLAMA_MAX_ATTEMPTS", "3")),
+            hedge_percentile=float(os.getenv("OLLAMA_HEDGE_PERCENTILE", "0")),
+        )
+
+    def backoff(self, attempt):
+        """Delay before retry number ``attempt`` (1-based)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def timeout(self, remaining):
+        """(connect, read) timeouts that never outlive the remaining deadline"""
+        return (min(self.connect_timeout, remaining), min(self.read_timeout, remaining))
+
+
+class LatencyTracker:
+    """Sliding window of recent request latencies for hedging decisions"""
+
+    def __init__(self, window=200, min_samples=20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p):
+        """The ``p``-th percentile latency, or None until enough samples exist"""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+
+def normalize_model(name):
+    return name if ":" in name else f"{name}:latest"
+
+
+def log_generation_timing(model, data, backend_url=None):
+    """Log whether a finished generation was cold (paid a model load) or warm"""
+    load = data.get("load_duration", 0) / 1e9
+    total = data.get("total_duration", 0) / 1e9
+    where = f" on {backend_url}" if backend_url else ""
+    if load >= COLD_LOAD_SECONDS:
+        logging.info(f"Cold generation of {model}{where}: {total:.2f}s total, {load:.2f}s loading the model")
+    else:
+        logging.info(f"Warm generation of {model}{where}: {total:.2f}s total")
+
+
+def parse_hours(value):
+    """'08:00-18:00' -> (480, 1080) minutes after midnight"""
+    def to_minutes(hhmm):
+        hour, _, minute = hhmm.strip().partition(":")
+        return int(hour) * 60 + int(minute or 0)
+
+    start, end = value.split("-")
+    return to_minutes(start), to_minutes(end)
+
+
+def parse_days(value):
+    """'mon-fri' or 'mon,wed,fri' -> set of weekday numbers (Monday is 0)"""
+    days = set()
+    for part in value.lower().split(","):
+        part = part.strip()
+        if "-" in part:
+            first, last = (WEEKDAYS.index(day.strip()[:3]) for day in part.split("-"))
+            days.update(range(first, last + 1))
+        elif part:
+            days.add(WEEKDAYS.index(part[:3]))
+    return days
+
+
+def model_details(entry):
+    """The metadata worth showing from an /api/tags model entry"""
+    details = entry.get("details") or {}
+    return {
+        "size": entry.get("size"),
+        "family": details.get("family"),
+        "parameter_size": details.get("parameter_size"),
+        "quantization": details.get("quantization_level"),
+    }
+
+
+def parse_backend_urls(value):
+    """Split a comma-separated list of Ollama URLs into base URLs"""
+    urls = []
+    for url in value.split(","):
+        url = url.strip().rstrip("/")
+        if not url:
+            continue
+        if "/api/" in url:
+            url = url[:url.index("/api/")]
+        urls.append(url)
+    return urls
+
+
+class Backend:
+    def __init__(self, url):
+        self.url = url
+        self.outstanding = 0
+        self.healthy = True
+        self.models = None  # None until the first successful probe
+        self.model_details = {}
+        self.loaded_models = set()
+        self.failures = 0
+        self.open_until = 0.0
+        self.trial_in_flight = False
+        self.last_checked = None
+
+    def has_model(self, model):
+        return self.models is None or normalize_model(model) in self.models
+
+    def snapshot(self):
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "circuit_open": self.open_until > time.monotonic(),
+            "failures": self.failures,
+            "models": sorted(self.models) if self.models is not None else None,
+            "loaded_models": sorted(self.loaded_models),
+        }
+
+
+class BackendPool:
+    def __init__(self, urls, session=None, health_interval=15, failure_threshold=3,
+                 cooldown=30, probe_timeout=3):
+        if not urls:
+            raise ValueError("At least one Ollama backend URL is required")
+        self.backends = [Backend(url) for url in urls]
+        self.session = session or requests.Session()
+        self.health_interval = health_interval
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.probe_timeout = probe_timeout
+        self._lock = threading.Lock()
+        self._health_thread = None
+        self._turn = 0  # rotates which backend wins a tie
+
+    @classmethod
+    def from_env(cls, default_url="http://localhost:11434", session=None):
+        """Build a pool from OLLAMA_BACKENDS (comma-separated) or ``default_url``"""
+        return cls(
+            parse_backend_urls(os.getenv("OLLAMA_BACKENDS", "") or default_url),
+            session=session,
+            health_interval=float(os.getenv("OLLAMA_HEALTH_INTERVAL", "15")),
+            failure_threshold=int(os.getenv("OLLAMA_FAILURE_THRESHOLD", "3")),
+            cooldown=float(os.getenv("OLLAMA_CIRCUIT_COOLDOWN", "30")),
+        )
+
+    def __len__(self):
+        return len(self.backends)
+
+    def acquire(self, model, exclude=()):
+        """Pick a backend for ``model`` and count the request against it
+
+        Backends in ``exclude`` are skipped. Every successful acquire must be
+        paired with ``release``.
+        """
+        with self._lock:
+            now = time.monotonic()
+            turn = self._turn % len(self.backends)
+            self._turn += 1
+            available = [
+                b for b in self.backends[turn:] + self.backends[:turn]
+                if b.open_until <= now and not b.trial_in_flight and b.has_model(model)
+                and b not in exclude
+            ]
+            # Prefer backends that passed their last probe, but still try the
+            # others rather than failing outright (e.g. right after startup)
+            candidates = [b for b in available if b.healthy] or available
+            if not candidates:
+                raise NoBackendAvailable(f"No healthy Ollama backend has model {model}")
+
+            wanted = normalize_model(model)
+            backend = min(candidates, key=lambda b: (b.outstanding, wanted not in b.loaded_models))
+            if backend.failures >= self.failure_threshold:
+                # Half-open circuit: let exactly one trial request through
+                backend.trial_in_flight = True
+            backend.outstanding += 1
+            return backend
+
+    def release(self, backend, success):
+        with self._lock:
+            backend.outstanding -= 1
+            backend.trial_in_flight = False
+            self._record(backend, success)
+
+    def probe(self, backend):
+        """Refresh a backend's health and model lists from /api/tags and /api/ps"""
+        try:
+            response = self.session.get(f"{backend.url}/api/tags", timeout=self.probe_timeout)
+            response.raise_for_status()
+            details = {normalize_model(m["name"]): model_details(m) for m in response.json().get("models", [])}
+        except Exception as e:
+            # Only log the transition, not every failed probe of a dead node
+            log = logging.warning if backend.healthy else logging.debug
+            log(f"Ollama backend {backend.url} failed health check: {e}")
+            with self._lock:
+                backend.healthy = False
+                backend.last_checked = time.time()
+                self._record(backend, False)
+            return False
+
+        loaded = set()
+        try:
+            response = self.session.get(f"{backend.url}/api/ps", timeout=self.probe_timeout)
+            if response.ok:
+                loaded = {normalize_model(m["name"]) for m in response.json().get("models", [])}
+        except Exception:
+            pass  # older servers have no /api/ps
+
+        with self._lock:
+            if not backend.healthy:
+                logging.info(f"Ollama backend {backend.url} is healthy again")
+            backend.healthy = True
+            backend.models = set(details)
+            backend.model_details = details
+            backend.loaded_models = loaded
+            backend.last_checked = time.time()
+            self._record(backend, True)
+        return True
+
+    def probe_all(self):
+        return [self.probe(backend) for backend in self.backends]
+
+    def warm_up(self, model, keep_alive=None, timeout=120):
+        """Load ``model`` on every healthy backend that has it with an empty generation
+
+        An empty prompt makes Ollama load the model (and restart its
+        keep_alive timer) without generating anything. Returns the number of
+        backends that now have the model resident.
+        """
+        payload = {"model": model}
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        warmed = 0
+        for backend in self.backends:
+            if not backend.healthy or not backend.has_model(model):
+                continue
+            started = time.monotonic()
+            try:
+                response = self.session.post(f"{backend.url}/api/generate", json=payload, timeout=timeout)
+                response.raise_for_status()
+                data = response.json()
+            except Exception as e:
+                logging.warning(f"Failed to warm up {model} on {backend.url}: {e}")
+                continue
+            load = data.get("load_duration", 0) / 1e9
+            logging.info(f"Warmed up {model} on {backend.url} in {time.monotonic() - started:.2f}s "
+                         f"({load:.2f}s loading the model)")
+            with self._lock:
+                backend.loaded_models.add(normalize_model(model))
+            warmed += 1
+        return warmed
+
+    def start_health_checks(self):
+        """Probe all backends now and then every ``health_interval`` seconds"""
+        if self._health_thread is not None:
+            return
+
+        def loop():
+            while True:
+                self.probe_all()
+                time.sleep(self.health_interval)
+
+        self._health_thread = threading.Thread(target=loop, name="ollama-health", daemon=True)
+        self._health_thread.start()
+
+    def models(self):
+        """Union of the models known on healthy backends"""
+        with self._lock:
+            names = set()
+            for backend in self.backends:
+                if backend.healthy and backend.models:
+                    names |= backend.models
+            return sorted(names)
+
+    def catalog(self):
+        """Per-model metadata merged across healthy backends, loaded models first"""
+        with self._lock:
+            merged = {}
+            for backend in self.backends:
+                if not backend.healthy or not backend.models:
+                    continue
+                for name in backend.models:
+                    entry = merged.get(name)
+                    if entry is None:
+                        entry = merged[name] = {
+                            "name": name, **backend.model_details.get(name, {}),
+                            "loaded": False, "backends": 0,
+                        }
+                    entry["backends"] += 1
+                    entry["loaded"] = entry["loaded"] or name in backend.loaded_models
+        return sorted(merged.values(), key=lambda m: (not m["loaded"], m["name"]))
+
+    def stats(self):
+        with self._lock:
+            return [backend.snapshot() for backend in self.backends]
+
+    def _record(self, backend, success):
+        if success:
+            backend.failures = 0
+            backend.open_until = 0.0
+            return
+        backend.failures += 1
+        if backend.failures >= self.failure_threshold:
+            backend.open_until = time.monotonic() + self.cooldown
+            if backend.failures == self.failure_threshold:
+                logging.warning(f"Circuit opened for Ollama backend {backend.url} for {self.cooldown}s")
+
+
+class ModelRegistry:
+    """Cached, lazily refreshed view of the models a BackendPool can serve.
+
+    ``catalog`` never waits on the network: once the data is older than
+    ``ttl`` it starts a background refresh and returns what it has.
+    ``refresh`` probes every backend right away, bounded by the pool's
+    short probe timeout.
+    """
+
+    def __init__(self, pool, ttl=60):
+        self.pool = pool
+        self.ttl = ttl
+        self._refreshing = threading.Lock()
+
+    def catalog(self):
+        if self._stale():
+            self.refresh_async()
+        return self.pool.catalog()
+
+    def refresh(self):
+        with self._refreshing:
+            self.pool.probe_all()
+        return self.pool.catalog()
+
+    def refresh_async(self):
+        if not self._refreshing.acquire(blocking=False):
+            return  # a refresh is already running
+
+        def run():
+            try:
+                self.pool.probe_all()
+            finally:
+                self._refreshing.release()
+
+        threading.Thread(target=run, name="ollama-models", daemon=True).start()
+
+    def _stale(self):
+        checked = [backend.last_checked for backend in self.pool.backends]
+        return None in checked or time.time() - min(checked) > self.ttl
+
+
+class KeepAlivePinger:
+    """Keep a model resident on every backend during business hours.
+
+    Every ``interval`` seconds inside ``hours`` on ``days`` (local time) the
+    pool re-runs its empty warm-up generation, which restarts Ollama's
+    keep_alive timer. Outside those hours nothing is sent and the model
+    unloads once ``keep_alive`` runs out.
+    """
+
+    def __init__(self, pool, model, keep_alive="30m", interval=240,
+                 hours="08:00-18:00", days="mon-fri"):
+        self.pool = pool
+        self.model = model
+        self.keep_alive = keep_alive
+        self.interval = interval
+        self.hours = parse_hours(hours)
+        self.days = parse_days(days)
+        self._thread = None
+        self._stopped = threading.Event()
+
+    @classmethod
+    def from_env(cls, pool, model, keep_alive="30m"):
+        """Build a pinger from KEEPALIVE_* settings, or None when KEEPALIVE_HOURS is empty"""
+        hours = os.getenv("KEEPALIVE_HOURS", "08:00-18:00")
+        if not hours:
+            return None
+        return cls(
+            pool, model, keep_alive=keep_alive,
+            interval=float(os.getenv("KEEPALIVE_INTERVAL", "240")),
+            hours=hours,
+            days=os.getenv("KEEPALIVE_DAYS", "mon-fri"),
+        )
+
+    def active(self, now=None):
+        now = now or datetime.now()
+        minutes = now.hour * 60 + now.minute
+        start, end = self.hours
+        in_hours = start <= minutes < end if start <= end else minutes >= start or minutes < end
+        return now.weekday() in self.days and in_hours
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        def loop():
+            while not self._stopped.wait(self.interval):
+                if self.active():
+                    self.pool.warm_up(self.model, self.keep_alive)
+
+        self._thread = threading.Thread(target=loop, name="ollama-keepalive", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
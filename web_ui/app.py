@@ -1,266 +1,997 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, g, render_template, request, jsonify
 import cv2
-import base64
-import numpy as np
 import threading
+import concurrent.futures
+import json
 import logging
+import math
+import queue
+import tempfile
 import traceback
 import os
 import requests
 import re
+import sys
 import time
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ollama_backends import (
+    RETRYABLE_STATUSES,
+    BackendPool,
+    KeepAlivePinger,
+    LatencyTracker,
+    NoBackendAvailable,
+    RetryPolicy,
+    log_generation_timing,
+)
+import metrics
+from batch import OUTPUT_FORMATS, BatchRunner, BatchWriter, collect_items, run_batch
+from image_store import ImageStore, SharedImageStore
+from near_duplicate import NearDuplicateIndex, dhash
+from preprocess import ImagePreprocessor
+from result_cache import ResultCache, cache_key
+from scheduler import AnalysisScheduler, SchedulerSaturated, SharedSlots
+from video import SceneSampler, analyze_video
 
 # === Logger Setup ===
-logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s')
+# Per-request details are logged at DEBUG; set LOG_LEVEL=DEBUG to see them
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format='[%(levelname)s] %(message)s')
 
 # === Configuration ===
 OLLAMA_API_URL = os.getenv("OLLAMA_API_URL", "http://localhost:11434/api/generate")
 MODEL_NAME = os.getenv("MODEL_NAME", "llava:7b")
+IMAGE_SIZE = int(os.getenv("IMAGE_SIZE", "512"))  # target size of the image sent to the model
+IMAGE_RESIZE_MODE = os.getenv("IMAGE_RESIZE_MODE", "fit")  # stretch, fit or letterbox
+JPEG_QUALITY = int(os.getenv("JPEG_QUALITY", "85"))
+JPEG_TARGET_BYTES = int(os.getenv("JPEG_TARGET_BYTES", "0"))  # 0 = no size target
+IMAGE_REDUCED_DECODE = os.getenv("IMAGE_REDUCED_DECODE", "true").lower() in ("1", "true", "yes")
+CLIENT_MAX_DIMENSION = int(os.getenv("CLIENT_MAX_DIMENSION", "1024"))  # browser downscales uploads to this
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", "32"))  # keep-alive connections per host
+OLLAMA_MAX_INFLIGHT = int(os.getenv("OLLAMA_MAX_INFLIGHT", "8"))  # concurrent Ollama calls (async server)
+IMAGE_STORE_MAX_ENTRIES = int(os.getenv("IMAGE_STORE_MAX_ENTRIES", "256"))
+IMAGE_STORE_TTL = float(os.getenv("IMAGE_STORE_TTL", "1800"))
+IMAGE_STORE_PATH = os.getenv("IMAGE_STORE_PATH", "")  # sqlite file shared by worker processes, empty = in memory
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "1024"))  # 0 disables the cache
+RESULT_CACHE_PATH = os.getenv("RESULT_CACHE_PATH", "")  # sqlite file for a persistent tier
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "0")) or None  # seconds, 0 = no expiry
+NEAR_DUPLICATE_ENABLED = os.getenv("NEAR_DUPLICATE_ENABLED", "false").lower() in ("1", "true", "yes")
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.getenv("NEAR_DUPLICATE_MAX_DISTANCE", "4"))  # bits out of 64
+NEAR_DUPLICATE_TTL = float(os.getenv("NEAR_DUPLICATE_TTL", "30"))
+NEAR_DUPLICATE_MAX_ENTRIES = int(os.getenv("NEAR_DUPLICATE_MAX_ENTRIES", "256"))
+OLLAMA_NUM_PARALLEL = int(os.getenv("OLLAMA_NUM_PARALLEL", "1"))  # generations per Ollama backend, match the server's setting
+OLLAMA_SLOT_DIR = os.getenv("OLLAMA_SLOT_DIR", "")  # lock files sharing OLLAMA_NUM_PARALLEL between worker processes
+SCHEDULER_MAX_QUEUE = int(os.getenv("SCHEDULER_MAX_QUEUE", "32"))
+SCHEDULER_MAX_PER_CLIENT = int(os.getenv("SCHEDULER_MAX_PER_CLIENT", "8"))
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")  # how long Ollama keeps the model loaded after a request
+BATCH_ROOT = os.getenv("BATCH_ROOT", "")  # folder /batch may read and write; empty = zip uploads only
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "2"))  # Ollama requests in flight per batch
+BATCH_DECODE_WORKERS = int(os.getenv("BATCH_DECODE_WORKERS", "0")) or None  # decode threads, 0 = CPU count
+OLLAMA_WARMUP = os.getenv("OLLAMA_WARMUP", "true").lower() in ("1", "true", "yes")  # preload MODEL_NAME at startup
+MAX_CONTENT_LENGTH = int(os.getenv("MAX_CONTENT_LENGTH", str(100 * 1024 * 1024)))  # request body limit in bytes
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "64"))  # per worker, 0 = unlimited; gunicorn derives it from WEB_THREADS
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "30"))  # seconds to finish Ollama calls on exit
+ANALYSIS_FORMAT = os.getenv("ANALYSIS_FORMAT", "text").lower()  # text (scraped with FIELD_PATTERNS) or json (schema output)
+ANALYSIS_NUM_PREDICT = int(os.getenv("ANALYSIS_NUM_PREDICT", "256"))  # token cap per json analysis, 0 = no cap
 
 # === Prompts ===
 PERSON_PROMPT = """Analyze this image and provide a detailed description of:\n1. If a person is present, identify:\n   - Age range (e.g., \"Age: 18-25 years\")\n   - Gender (\"Male\" or \"Female\")\n   - Clothing type, color, and accessories\n2. Describe the surrounding environment (indoor/outdoor, objects, time of day if possible)\n\nRespond in this format:\nAge: XX-XX years\nGender: Male/Female\nClothing: [description]\nEnvironment: [description]"""
 
+STRUCTURED_PROMPT = """Analyze this image and describe:\n- age: the person's age range (e.g. \"18-25 years\")\n- gender: \"Male\" or \"Female\"\n- clothing: clothing type, color, and accessories\n- environment: the surroundings (indoor/outdoor, objects, time of day if possible)\n\nIf no person is present, use \"Unknown\" for age, gender and clothing. Respond with JSON only."""
+
 CHAT_PROMPT = """You are an AI assistant that can analyze images. The user has uploaded an image and is asking you questions about it. 
 Provide helpful, accurate, and detailed responses about what you can see in the image. 
 If the user asks about something not visible in the image, politely let them know.
 
 User question: {question}"""
 
-# === API Connection Test ===
+# Fields scraped from PERSON_PROMPT responses, in the order the model emits them
+FIELD_PATTERNS = {
+    "age": r"Age:\s*([^\n]+)",
+    "gender": r"Gender:\s*([^\n]+)",
+    "clothing": r"Clothing:\s*([^\n]+)",
+    "environment": r"Environment:\s*([^\n]+)",
+}
+
+# Ollama constrains STRUCTURED_PROMPT replies to this schema (format parameter)
+ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {label: {"type": "string"} for label in FIELD_PATTERNS},
+    "required": list(FIELD_PATTERNS),
+}
+# A completed "field": "value" pair in a partial structured reply
+STRUCTURED_FIELD = re.compile(r'"(\w+)"\s*:\s*("(?:[^"\\]|\\.)*")')
+
+# Prompt and extra /api/generate parameters of the configured analysis mode
+if ANALYSIS_FORMAT == "json":
+    ANALYSIS_PROMPT = STRUCTURED_PROMPT
+    # The schema grammar ends the reply at the closing brace; num_predict bounds the rest
+    ANALYSIS_REQUEST = {"format": ANALYSIS_SCHEMA, "options": {}}
+    if ANALYSIS_NUM_PREDICT > 0:
+        ANALYSIS_REQUEST["options"]["num_predict"] = ANALYSIS_NUM_PREDICT
+elif ANALYSIS_FORMAT == "text":
+    ANALYSIS_PROMPT = PERSON_PROMPT
+    ANALYSIS_REQUEST = {"options": {}}
+else:
+    raise ValueError(f"Unknown ANALYSIS_FORMAT {ANALYSIS_FORMAT!r}, expected 'text' or 'json'")
+
+class OllamaError(Exception):
+    """Raised when a streaming generation fails"""
+
+# === HTTP Session ===
+# One pooled session so consecutive Ollama calls reuse keep-alive connections
+http_session = requests.Session()
+http_session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=OLLAMA_POOL_SIZE))
+http_session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=OLLAMA_POOL_SIZE))
+
+# === Ollama Backends ===
+# Ollama servers to balance across (OLLAMA_BACKENDS, comma-separated), OLLAMA_API_URL when unset
+backends = BackendPool.from_env(default_url=OLLAMA_API_URL, session=http_session)
+retry_policy = RetryPolicy.from_env()
+latency_tracker = LatencyTracker()
+hedge_executor = concurrent.futures.ThreadPoolExecutor(max_workers=OLLAMA_POOL_SIZE, thread_name_prefix="ollama-hedge")
+
+def generation_finished(data, backend_url=None):
+    """Log and export the timing fields of a finished Ollama generation"""
+    log_generation_timing(MODEL_NAME, data, backend_url)
+    metrics.record_generation(data)
+
+def backend_at_fault(status_code):
+    """Whether an HTTP error status should count against the backend's health"""
+    return status_code >= 500 or status_code == 404  # 404: model missing on that node
+
+# === Startup ===
 def test_api_connection():
-    """Test if the Ollama API is reachable"""
+    """Test if the Ollama backends are reachable and have MODEL_NAME"""
+    reachable = False
+    for backend, ok in zip(backends.backends, backends.probe_all()):
+        if not ok:
+            logging.error(f"✗ Cannot connect to Ollama API at {backend.url}")
+        elif not backend.has_model(MODEL_NAME):
+            logging.warning(f"✗ Ollama API at {backend.url} is reachable but has no model {MODEL_NAME}")
+        else:
+            logging.info(f"✓ Ollama API at {backend.url} is reachable")
+            reachable = True
+    return reachable
+
+keepalive_pinger = None
+
+def start_model_keeper():
+    """Preload MODEL_NAME and keep it resident during KEEPALIVE_HOURS"""
+    global keepalive_pinger
+    if OLLAMA_WARMUP:
+        logging.info(f"Warming up {MODEL_NAME} (keep_alive={OLLAMA_KEEP_ALIVE})")
+        backends.warm_up(MODEL_NAME, OLLAMA_KEEP_ALIVE)
+    keepalive_pinger = KeepAlivePinger.from_env(backends, MODEL_NAME, OLLAMA_KEEP_ALIVE)
+    if keepalive_pinger is not None:
+        keepalive_pinger.start()
+
+def init_worker():
+    """Once per server process: check the backends, then warm up and pin the model"""
+    logging.info(f"Ollama backends: {', '.join(b.url for b in backends.backends)}")
+    logging.info(f"Model: {MODEL_NAME}")
+    if not test_api_connection():
+        logging.warning("⚠️  Ollama API is not reachable. Please ensure:")
+        logging.warning("   1. Ollama is installed and running")
+        logging.warning(f"   2. The model '{MODEL_NAME}' is available (run: ollama pull {MODEL_NAME})")
+        logging.warning("   3. OLLAMA_BACKENDS / OLLAMA_API_URL is correct: " + ", ".join(b.url for b in backends.backends))
+        logging.warning("   Server will start anyway, but image analysis will fail until it is reachable.")
+    # Warm-up skips unreachable backends; the pinger keeps trying once they come up
+    start_model_keeper()
+
+def shutdown_worker(timeout=SHUTDOWN_DRAIN_TIMEOUT):
+    """Let queued and running Ollama calls finish, then release pools and files"""
+    if keepalive_pinger is not None:
+        keepalive_pinger.stop()
+    stats = scheduler.stats()
+    if stats["queued"] or stats["running"]:
+        logging.info(f"Draining {stats['queued']} queued and {stats['running']} running analyses")
+    if not scheduler.drain(timeout):
+        logging.warning(f"Analyses still running after {timeout:.0f}s, shutting down anyway")
+    hedge_executor.shutdown(wait=False, cancel_futures=True)
+    if result_cache is not None:
+        result_cache.close()
+    if IMAGE_STORE_PATH:
+        image_store.close()
+    http_session.close()
+
+# === Retry Helper ===
+def send_leased(backend, path, payload, timeout, stream=False):
+    """Make one POST to a leased backend, returning (response, retryable)
+
+    The lease is released here unless a streaming response is handed back,
+    in which case it travels as ``response.backend`` for the caller to release.
+    """
+    url = backend.url + path
+    success, handed_off = False, False
+    started = time.monotonic()
     try:
-        test_url = OLLAMA_API_URL.replace('/api/generate', '/api/tags')
-        response = requests.get(test_url, timeout=10)
-        if response.status_code == 200:
-            logging.info("✓ Ollama API is reachable")
-            return True
+        logging.debug(f"Sending API call to {url}")
+        response = http_session.post(url, json=payload, timeout=timeout, stream=stream)
+        response.raise_for_status()
+        success = True
+        if stream:
+            response.backend = backend
+            handed_off = True
         else:
-            logging.error(f"✗ Ollama API returned status code: {response.status_code}")
-            return False
+            latency_tracker.record(time.monotonic() - started)
+        return response, False
+    except requests.exceptions.HTTPError as http_err:
+        status = http_err.response.status_code
+        logging.error(f"HTTP error from {url}: {http_err} - Status: {status}")
+        if status >= 500:
+            logging.error(f"Server error response: {http_err.response.text[:200]}")
+        success = not backend_at_fault(status)
+        return None, status in RETRYABLE_STATUSES
+    except requests.exceptions.Timeout as timeout_err:
+        logging.error(f"Timeout error from {url}: {timeout_err}")
+    except requests.exceptions.ConnectionError as conn_err:
+        logging.error(f"Connection error from {url}: {conn_err}")
+    except requests.exceptions.RequestException as req_err:
+        logging.error(f"Request exception from {url}: {req_err}")
     except Exception as e:
-        logging.error(f"✗ Cannot connect to Ollama API: {e}")
-        return False
+        logging.error(f"Unexpected error from {url}: {e}")
+    finally:
+        if not handed_off:
+            backends.release(backend, success)
+    return None, True
+
+def discard_response(future):
+    """Close the response of a hedged request that lost the race"""
+    response, _ = future.result()
+    if response is not None:
+        response.close()
+
+def hedged_post(backend, path, payload, timeout, remaining):
+    """Send to ``backend`` and, if it is slower than the configured latency
+    percentile, race a second request on another backend"""
+    hedge_after = latency_tracker.percentile(retry_policy.hedge_percentile)
+    primary = hedge_executor.submit(send_leased, backend, path, payload, timeout)
+    if hedge_after is None or hedge_after >= remaining:
+        return primary.result()
+    try:
+        return primary.result(timeout=hedge_after)
+    except concurrent.futures.TimeoutError:
+        pass
+
+    try:
+        second_backend = backends.acquire(payload.get("model", MODEL_NAME), exclude=(backend,))
+    except NoBackendAvailable:
+        return primary.result()
+    logging.info(f"Request slower than p{retry_policy.hedge_percentile:g} ({hedge_after:.2f}s), hedging to {second_backend.url}")
+    metrics.OLLAMA_HEDGES.inc()
+    secondary = hedge_executor.submit(send_leased, second_backend, path, payload, timeout)
+
+    pending = {primary, secondary}
+    outcome = (None, True)
+    while pending:
+        done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            response, retryable = future.result()
+            if response is not None:
+                for loser in pending:
+                    loser.add_done_callback(discard_response)
+                return response, False
+            outcome = (None, outcome[1] and retryable)
+    return outcome
+
+def retry_post(path, payload, stream=False):
+    """POST ``payload`` to ``path`` on a backend picked by the pool
+
+    Attempts are bounded by the overall OLLAMA_DEADLINE rather than a fixed
+    count of fixed timeouts: each attempt's read timeout is capped by the
+    time left, retries back off exponentially with jitter, and statuses that
+    cannot succeed on retry (most 4xx) fail immediately. Each attempt may go
+    to a different backend, and with several backends a slow first attempt
+    can be hedged (OLLAMA_HEDGE_PERCENTILE).
+
+    For streaming responses the backend stays leased until the caller passes
+    ``response.backend`` back to ``backends.release``.
+    """
+    model = payload.get("model", MODEL_NAME)
+    deadline_at = time.monotonic() + retry_policy.deadline
+    hedge = not stream and retry_policy.hedge_percentile > 0 and len(backends) > 1
+    attempt = 0
+    while attempt < retry_policy.max_attempts:
+        attempt += 1
+        remaining = deadline_at - time.monotonic()
+        if remaining <= 0:
+            break
+        timeout = retry_policy.timeout(remaining)
 
-# === Retry Helper ===
-def retry_post(url, payload, retries=3, delay=5):
-    for attempt in range(retries):
         try:
-            logging.info(f"Attempting API call {attempt+1}/{retries} to {url}")
-            response = requests.post(url, json=payload, timeout=30)
-            response.raise_for_status()
-            logging.info(f"✓ API call successful on attempt {attempt+1}")
+            backend = backends.acquire(model)
+        except NoBackendAvailable as e:
+            logging.error(f"No backend for attempt {attempt}/{retry_policy.max_attempts}: {e}")
+            metrics.record_attempt("no_backend")
+            response, retryable = None, True
+        else:
+            logging.debug(f"Attempting API call {attempt}/{retry_policy.max_attempts} to {backend.url}")
+            if hedge:
+                response, retryable = hedged_post(backend, path, payload, timeout, remaining)
+            else:
+                response, retryable = send_leased(backend, path, payload, timeout, stream)
+            metrics.record_attempt("success" if response is not None else "retryable" if retryable else "fatal")
+
+        if response is not None:
+            logging.debug(f"✓ API call successful on attempt {attempt}")
             return response
-        except requests.exceptions.HTTPError as http_err:
-            logging.error(f"HTTP error during retry {attempt+1}/{retries}: {http_err} - Status: {http_err.response.status_code}")
-            if http_err.response.status_code >= 500:
-                logging.error(f"Server error response: {http_err.response.text[:200]}")
-        except requests.exceptions.Timeout as timeout_err:
-            logging.error(f"Timeout error during retry {attempt+1}/{retries}: {timeout_err}")
-        except requests.exceptions.ConnectionError as conn_err:
-            logging.error(f"Connection error during retry {attempt+1}/{retries}: {conn_err}")
-        except requests.exceptions.RequestException as req_err:
-            logging.error(f"Request exception during retry {attempt+1}/{retries}: {req_err}")
-        except Exception as e:
-            logging.error(f"Unexpected error during retry {attempt+1}/{retries}: {e}")
-        
-        if attempt < retries - 1:
-            logging.info(f"Waiting {delay} seconds before retry...")
+        if not retryable:
+            logging.error("API call failed with a non-retryable error")
+            return None
+
+        delay = retry_policy.backoff(attempt)
+        if attempt < retry_policy.max_attempts and time.monotonic() + delay < deadline_at:
+            logging.debug(f"Waiting {delay:.2f} seconds before retry...")
             time.sleep(delay)
     
-    logging.error(f"All {retries} API call attempts failed")
+    logging.error(f"API call failed after {attempt} attempt(s) within the {retry_policy.deadline:g}s deadline")
     return None
 
 # === Analyzer Class ===
 class RealTimeAnalyzer:
+    def __init__(self, preprocessor=None, result_cache=None, near_duplicates=None):
+        self.preprocessor = preprocessor or ImagePreprocessor()
+        self.result_cache = result_cache
+        self.near_duplicates = near_duplicates
+
+    def frame_hash(self, image_np):
+        """Perceptual hash used for near-duplicate lookups, if enabled"""
+        if self.near_duplicates is None:
+            return None
+        return dhash(image_np)
+
     def parse_response(self, response_text):
+        """Scrape the FIELD_PATTERNS fields, listing any that are missing in result["unparsed"]"""
+        unparsed = []
+
         def extract(pattern, label):
             try:
                 return re.search(pattern, response_text, re.IGNORECASE).group(1)
             except:
                 logging.warning(f"Could not parse {label}")
+                unparsed.append(label)
                 return "Unknown"
 
-        return {
-            "age": extract(r"Age:\s*([^\n]+)", "age"),
-            "gender": extract(r"Gender:\s*([^\n]+)", "gender"),
-            "clothing": extract(r"Clothing:\s*([^\n]+)", "clothing"),
-            "environment": extract(r"Environment:\s*([^\n]+)", "environment"),
+        result = {label: extract(pattern, label) for label, pattern in FIELD_PATTERNS.items()}
+        if unparsed:
+            result["unparsed"] = unparsed
+        return result
+
+    def parse_structured(self, response_text):
+        """Validate a schema-constrained JSON response in a single parse
+
+        A reply cut short by num_predict keeps the fields it completed; the
+        others are listed in "unparsed".
+        """
+        try:
+            data = json.loads(response_text)
+        except ValueError:
+            logging.warning("Structured response is not complete JSON, keeping the finished fields")
+            data = {match.group(1): json.loads(match.group(2)) for match in STRUCTURED_FIELD.finditer(response_text)}
+        if not isinstance(data, dict):
+            data = {}
+
+        result, missing = {}, []
+        for label in FIELD_PATTERNS:
+            value = data.get(label)
+            if not isinstance(value, str) or not value.strip():
+                missing.append(label)
+                value = "Unknown"
+            result[label] = value.strip()
+        if missing:
+            logging.warning(f"Could not parse {', '.join(missing)}")
+            result["unparsed"] = missing
+        return result
+
+    def parse_analysis(self, response_text):
+        """Parse an analysis reply in the configured ANALYSIS_FORMAT"""
+        if ANALYSIS_FORMAT == "json":
+            return self.parse_structured(response_text)
+        return self.parse_response(response_text)
+
+    def stream_parser(self):
+        """Incremental field parser for a streamed analysis reply"""
+        if ANALYSIS_FORMAT == "json":
+            return StructuredStreamParser()
+        return FieldStreamParser(self)
+
+    def parse_line(self, line):
+        """Return (field, value) if a single response line holds a known field"""
+        for label, pattern in FIELD_PATTERNS.items():
+            match = re.search(pattern, line, re.IGNORECASE)
+            if match:
+                return label, match.group(1).strip()
+        return None
+
+    def decode_image(self, data):
+        """Decode uploaded image bytes, returning None for unreadable data"""
+        return self.preprocessor.decode(data)
+
+    def encode_image(self, image_np):
+        """Resize and encode an image into the base64 JPEG payload sent to Ollama"""
+        image_base64 = self.preprocessor.encode(image_np)
+        if image_base64 is None:
+            return None
+        logging.debug(f"Image encoded to base64, size: {len(image_base64)} characters")
+        return image_base64
+
+    def generate(self, prompt, image_base64, extra=None):
+        """Send a single generation request and return (output, error)
+
+        ``extra`` adds request parameters such as ``format`` and ``options``.
+        """
+        payload = {
+            "model": MODEL_NAME,
+            "prompt": prompt,
+            "images": [image_base64],
+            "stream": False,
+            "keep_alive": OLLAMA_KEEP_ALIVE,
+            **(extra or {}),
+        }
+
+        logging.debug(f"Sending request to API with model: {MODEL_NAME}")
+        started = time.perf_counter()
+        response = retry_post("/api/generate", payload)
+        metrics.observe_stage("generation", time.perf_counter() - started)
+
+        if response is None:
+            logging.error("Failed to get valid response after retries from Ollama API.")
+            return None, "API connection failed after retries"
+
+        # Check content type
+        content_type = response.headers.get('Content-Type', '')
+        if 'application/json' not in content_type:
+            logging.error(f"Unexpected content type: {content_type}")
+            logging.error(f"Response text: {response.text[:500]}")
+            return None, f"Invalid API response format: {content_type}"
+
+        # Parse JSON response
+        try:
+            response_data = response.json()
+            logging.debug(f"Received JSON response: {list(response_data.keys())}")
+        except ValueError as json_err:
+            logging.error(f"Error parsing JSON: {json_err}")
+            logging.error(f"Response text: {response.text[:500]}")
+            return None, "Invalid JSON response from API"
+
+        # Extract response text
+        output = response_data.get("response", "")
+        if not output:
+            logging.warning("Empty response from API")
+            return None, "Empty response from API"
+
+        generation_finished(response_data)
+        logging.debug(f"API response received, length: {len(output)} characters")
+        logging.debug(f"Response preview: {output[:200]}...")
+        return output, None
+
+    def stream_generate(self, prompt, image_base64, extra=None):
+        """Yield response tokens as Ollama produces them
+
+        Closing the generator early drops the connection, which makes
+        Ollama stop generating.
+        """
+        payload = {
+            "model": MODEL_NAME,
+            "prompt": prompt,
+            "images": [image_base64],
+            "stream": True,
+            "keep_alive": OLLAMA_KEEP_ALIVE,
+            **(extra or {}),
         }
 
+        logging.debug(f"Sending streaming request to API with model: {MODEL_NAME}")
+        started = time.perf_counter()
+        response = retry_post("/api/generate", payload, stream=True)
+        if response is None:
+            raise OllamaError("API connection failed after retries")
+
+        success = False
+        try:
+            with response:
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    try:
+                        chunk = json.loads(line)
+                    except ValueError:
+                        raise OllamaError("Invalid JSON in streamed response")
+                    if "error" in chunk:
+                        raise OllamaError(chunk["error"])
+                    token = chunk.get("response", "")
+                    if token:
+                        yield token
+                    if chunk.get("done"):
+                        generation_finished(chunk, response.backend.url)
+                        break
+            success = True
+            metrics.observe_stage("generation", time.perf_counter() - started)
+        except GeneratorExit:
+            success = True  # the client went away or the reply was complete, not a backend fault
+            raise
+        finally:
+            backends.release(response.backend, success)
+
     def analyze_image(self, image_np):
         try:
-            logging.info("Starting image analysis...")
-            
-            # Resize and encode image
-            resized = cv2.resize(image_np, (512, 512))
-            _, img_encoded = cv2.imencode('.jpg', resized)
-            if not _:
-                logging.error("Failed to encode image to JPEG")
+            logging.debug("Starting image analysis...")
+            image_base64 = self.encode_image(image_np)
+            if image_base64 is None:
                 return None
-                
-            image_base64 = base64.b64encode(img_encoded).decode('utf-8')
-            logging.info(f"Image encoded to base64, size: {len(image_base64)} characters")
-
-            payload = {
-                "model": MODEL_NAME,
-                "prompt": PERSON_PROMPT,
-                "images": [image_base64],
-                "stream": False
-            }
-            
-            logging.info(f"Sending request to API with model: {MODEL_NAME}")
-            response = retry_post(OLLAMA_API_URL, payload)
-            
-            if response is None:
-                logging.error("Failed to get valid response after retries from Ollama API.")
-                return {"error": "API connection failed after retries"}
-                
-            # Check content type
-            content_type = response.headers.get('Content-Type', '')
-            if 'application/json' not in content_type:
-                logging.error(f"Unexpected content type: {content_type}")
-                logging.error(f"Response text: {response.text[:500]}")
-                return {"error": f"Invalid API response format: {content_type}"}
-            
-            # Parse JSON response
-            try:
-                response_data = response.json()
-                logging.info(f"Received JSON response: {list(response_data.keys())}")
-            except ValueError as json_err:
-                logging.error(f"Error parsing JSON: {json_err}")
-                logging.error(f"Response text: {response.text[:500]}")
-                return {"error": "Invalid JSON response from API"}
-            
-            # Extract response text
-            output = response_data.get("response", "")
-            if not output:
-                logging.warning("Empty response from API")
-                return {"error": "Empty response from API"}
-                
-            logging.info(f"API response received, length: {len(output)} characters")
-            logging.info(f"Response preview: {output[:200]}...")
-            
-            # Parse the response
-            result = self.parse_response(output)
-            result["raw_response"] = output  # Include raw response for debugging
-            
-            logging.info("Analysis completed successfully")
-            return result
-            
+            return self.analyze_encoded(image_base64, self.frame_hash(image_np))
+
         except cv2.error as cv_err:
             logging.error(f"OpenCV error during image processing: {cv_err}")
             return {"error": "Image processing failed"}
+
+    def cached_analysis(self, image_base64, frame_hash=None):
+        """Look up a previous analysis of this image, returning (key, result)
+
+        ``key`` identifies the analysis for caching and request coalescing and
+        ``result`` is None on a miss. When ``frame_hash`` is given, recent
+        frames within the configured Hamming distance also count as a hit.
+        """
+        key = cache_key(image_base64, MODEL_NAME, ANALYSIS_PROMPT)
+        if self.result_cache is not None:
+            cached = self.result_cache.get(key)
+            if cached is not None:
+                logging.debug("Analysis served from result cache")
+                cached["cached"] = True
+                return key, cached
+
+        if frame_hash is not None:
+            match = self.near_duplicates.find(frame_hash)
+            if match is not None:
+                previous, distance = match
+                logging.debug(f"Near-duplicate frame (distance {distance}), reusing previous analysis")
+                previous["near_duplicate"] = True
+                previous["hash_distance"] = distance
+                return key, previous
+
+        return key, None
+
+    def store_analysis(self, key, frame_hash, result):
+        # A reply that drifted from the format is not reused, so the next request tries again
+        if result.get("unparsed"):
+            logging.warning("Not caching an analysis with unparsed fields")
+            return
+        if self.result_cache is not None:
+            self.result_cache.put(key, result)
+        if frame_hash is not None:
+            self.near_duplicates.add(frame_hash, result)
+
+    def analyze_encoded(self, image_base64, frame_hash=None):
+        """Analyze an image that has already been prepared by encode_image"""
+        try:
+            key, cached = self.cached_analysis(image_base64, frame_hash)
+            if cached is not None:
+                return cached
+            return self.run_analysis(image_base64, key, frame_hash)
+
         except Exception as e:
             logging.error(f"Unexpected error during analysis: {e}")
             traceback.print_exc()
             return {"error": f"Analysis failed: {str(e)}"}
-    
+
+    def run_analysis(self, image_base64, key, frame_hash=None):
+        """Generate, parse and cache an analysis after a cache miss"""
+        try:
+            output, error = self.generate(ANALYSIS_PROMPT, image_base64, ANALYSIS_REQUEST)
+            if error:
+                return {"error": error}
+
+            # Parse the response
+            result = self.parse_analysis(output)
+            result["raw_response"] = output  # Include raw response for debugging
+            self.store_analysis(key, frame_hash, result)
+
+            logging.debug("Analysis completed successfully")
+            return result
+
+        except Exception as e:
+            logging.error(f"Unexpected error during analysis: {e}")
+            traceback.print_exc()
+            return {"error": f"Analysis failed: {str(e)}"}
+
+    def replay_analysis(self, result):
+        """Yield the stream events for an analysis that is already known"""
+        for label in FIELD_PATTERNS:
+            yield "field", {"name": label, "value": result.get(label, "Unknown")}
+        yield "done", result
+
+    def stream_analysis(self, image_base64, key, frame_hash=None):
+        """Yield (event, data) pairs while an analysis is generated
+
+        Each Age/Gender/Clothing/Environment field is emitted as soon as it
+        is complete, followed by a final ``done`` event with the result.
+        Generation stops once the parser has everything it needs.
+        """
+        parser = self.stream_parser()
+        tokens = self.stream_generate(ANALYSIS_PROMPT, image_base64, ANALYSIS_REQUEST)
+        try:
+            for token in tokens:
+                yield "token", {"token": token}
+                for name, value in parser.feed(token):
+                    yield "field", {"name": name, "value": value}
+                if parser.complete:
+                    logging.debug("All fields received, stopping the generation early")
+                    break
+        finally:
+            tokens.close()
+
+        for name, value in parser.finish():
+            yield "field", {"name": name, "value": value}
+        yield "done", self.finish_analysis(key, frame_hash, parser.output)
+
+    def finish_analysis(self, key, frame_hash, output):
+        """Parse and cache the full text of a streamed analysis"""
+        if not output:
+            raise OllamaError("Empty response from API")
+
+        result = self.parse_analysis(output)
+        result["raw_response"] = output
+        self.store_analysis(key, frame_hash, result)
+        logging.debug("Streaming analysis completed successfully")
+        return result
+
     def chat_with_image(self, image_np, user_message):
         """Chat about an image with the user"""
         try:
-            logging.info(f"Starting chat with message: {user_message[:50]}...")
-            
-            # Resize and encode image
-            resized = cv2.resize(image_np, (512, 512))
-            _, img_encoded = cv2.imencode('.jpg', resized)
-            if not _:
-                logging.error("Failed to encode image to JPEG")
+            image_base64 = self.encode_image(image_np)
+            if image_base64 is None:
                 return None
-                
-            image_base64 = base64.b64encode(img_encoded).decode('utf-8')
-            logging.info(f"Image encoded for chat, size: {len(image_base64)} characters")
+            return self.chat_with_encoded(image_base64, user_message)
 
-            # Format the chat prompt with user's question
-            formatted_prompt = CHAT_PROMPT.format(question=user_message)
-            
-            payload = {
-                "model": MODEL_NAME,
-                "prompt": formatted_prompt,
-                "images": [image_base64],
-                "stream": False
-            }
-            
-            logging.info(f"Sending chat request to API with model: {MODEL_NAME}")
-            response = retry_post(OLLAMA_API_URL, payload)
-            
-            if response is None:
-                logging.error("Failed to get valid response after retries from Ollama API.")
-                return {"error": "API connection failed after retries"}
-                
-            # Check content type
-            content_type = response.headers.get('Content-Type', '')
-            if 'application/json' not in content_type:
-                logging.error(f"Unexpected content type: {content_type}")
-                logging.error(f"Response text: {response.text[:500]}")
-                return {"error": f"Invalid API response format: {content_type}"}
-            
-            # Parse JSON response
-            try:
-                response_data = response.json()
-                logging.info(f"Received chat JSON response: {list(response_data.keys())}")
-            except ValueError as json_err:
-                logging.error(f"Error parsing JSON: {json_err}")
-                logging.error(f"Response text: {response.text[:500]}")
-                return {"error": "Invalid JSON response from API"}
-            
-            # Extract response text
-            output = response_data.get("response", "")
-            if not output:
-                logging.warning("Empty response from API")
-                return {"error": "Empty response from API"}
-                
-            logging.info(f"Chat API response received, length: {len(output)} characters")
-            logging.info(f"Chat response preview: {output[:200]}...")
-            
-            logging.info("Chat completed successfully")
-            return {"response": output}
-            
         except cv2.error as cv_err:
             logging.error(f"OpenCV error during chat image processing: {cv_err}")
             return {"error": "Image processing failed"}
+
+    def chat_with_encoded(self, image_base64, user_message):
+        """Chat about an image that has already been prepared by encode_image"""
+        try:
+            logging.debug(f"Starting chat with message: {user_message[:50]}...")
+
+            # Format the chat prompt with user's question
+            formatted_prompt = CHAT_PROMPT.format(question=user_message)
+            output, error = self.generate(formatted_prompt, image_base64)
+            if error:
+                return {"error": error}
+
+            logging.debug("Chat completed successfully")
+            return {"response": output}
+
         except Exception as e:
             logging.error(f"Unexpected error during chat: {e}")
             traceback.print_exc()
             return {"error": f"Chat failed: {str(e)}"}
 
-analyzer = RealTimeAnalyzer()
+    def stream_chat(self, image_base64, user_message):
+        """Yield (event, data) pairs while a chat reply is generated"""
+        logging.debug(f"Starting streaming chat with message: {user_message[:50]}...")
+        formatted_prompt = CHAT_PROMPT.format(question=user_message)
+        output = ""
+        for token in self.stream_generate(formatted_prompt, image_base64):
+            output += token
+            yield "token", {"token": token}
+
+        if not output:
+            raise OllamaError("Empty response from API")
+        logging.debug("Streaming chat completed successfully")
+        yield "done", {"response": output}
+
+class FieldStreamParser:
+    """Extract response fields from streamed tokens as each line completes"""
+
+    def __init__(self, analyzer):
+        self.analyzer = analyzer
+        self.output = ""
+        self._line_start = 0
+        self._seen = set()
+
+    @property
+    def complete(self):
+        """Whether every field has been seen, so the rest of the reply is not needed"""
+        return len(self._seen) == len(FIELD_PATTERNS)
+
+    def feed(self, token):
+        """Add a token and return the (field, value) pairs of lines it completed"""
+        self.output += token
+        fields = []
+        while True:
+            newline = self.output.find("\n", self._line_start)
+            if newline == -1:
+                break
+            field = self.analyzer.parse_line(self.output[self._line_start:newline])
+            self._line_start = newline + 1
+            if field:
+                fields.append(field)
+                self._seen.add(field[0])
+        return fields
+
+    def finish(self):
+        """Return the field on the trailing line, if any"""
+        field = self.analyzer.parse_line(self.output[self._line_start:])
+        self._line_start = len(self.output)
+        return [field] if field else []
+
+class StructuredStreamParser:
+    """Extract fields from a streamed JSON reply as each string value completes"""
+
+    def __init__(self):
+        self.output = ""
+        self.complete = False
+        self._seen = set()
+
+    def feed(self, token):
+        """Add a token and return the (field, value) pairs it completed"""
+        self.output += token
+        fields = []
+        for match in STRUCTURED_FIELD.finditer(self.output):
+            name = match.group(1)
+            if name in FIELD_PATTERNS and name not in self._seen:
+                self._seen.add(name)
+                fields.append((name, json.loads(match.group(2)).strip()))
+        if "}" in token and not self.complete:
+            try:
+                json.loads(self.output)
+                self.complete = True  # the object is closed, only whitespace could follow
+            except ValueError:
+                pass
+        return fields
+
+    def finish(self):
+        return []
+
+backends.start_health_checks()
+
+result_cache = None
+if RESULT_CACHE_SIZE > 0:
+    result_cache = ResultCache(
+        max_entries=RESULT_CACHE_SIZE,
+        path=RESULT_CACHE_PATH or None,
+        ttl=RESULT_CACHE_TTL,
+    )
+
+near_duplicates = None
+if NEAR_DUPLICATE_ENABLED:
+    near_duplicates = NearDuplicateIndex(
+        max_distance=NEAR_DUPLICATE_MAX_DISTANCE,
+        max_entries=NEAR_DUPLICATE_MAX_ENTRIES,
+        ttl=NEAR_DUPLICATE_TTL,
+    )
+
+preprocessor = ImagePreprocessor(
+    size=IMAGE_SIZE,
+    mode=IMAGE_RESIZE_MODE,
+    jpeg_quality=JPEG_QUALITY,
+    target_bytes=JPEG_TARGET_BYTES,
+    reduced_decode=IMAGE_REDUCED_DECODE,
+    observe=metrics.observe_stage,
+)
+
+analyzer = RealTimeAnalyzer(preprocessor=preprocessor, result_cache=result_cache, near_duplicates=near_duplicates)
+dispatch_concurrency = OLLAMA_NUM_PARALLEL * len(backends)
+scheduler = AnalysisScheduler(
+    concurrency=dispatch_concurrency,
+    max_queue=SCHEDULER_MAX_QUEUE,
+    max_per_client=SCHEDULER_MAX_PER_CLIENT,
+    observe=metrics.observe_stage,
+    slots=SharedSlots(OLLAMA_SLOT_DIR, dispatch_concurrency) if OLLAMA_SLOT_DIR else None,
+)
+if IMAGE_STORE_PATH:
+    image_store = SharedImageStore(IMAGE_STORE_PATH, max_entries=IMAGE_STORE_MAX_ENTRIES, ttl=IMAGE_STORE_TTL)
+else:
+    image_store = ImageStore(max_entries=IMAGE_STORE_MAX_ENTRIES, ttl=IMAGE_STORE_TTL)
+metrics.register_collector(
+    result_cache=result_cache,
+    near_duplicates=near_duplicates,
+    scheduler=scheduler,
+    backends=backends,
+)
 app = Flask(__name__, static_folder="static", template_folder="templates")
+app.config["MAX_CONTENT_LENGTH"] = MAX_CONTENT_LENGTH or None
+app.config["LIVE_ANALYSIS"] = False  # set by asgi_app, the only server with the /ws/live WebSocket
+
+# === Backpressure ===
+# Caps requests being handled per worker; a streamed response releases its
+# slot when the view returns, its Ollama work is bounded by the scheduler.
+request_slots = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS) if MAX_CONCURRENT_REQUESTS > 0 else None
+UNLIMITED_ENDPOINTS = {"static", "prometheus_metrics"}
+
+@app.before_request
+def reject_large_request():
+    # Checked up front: the routes' own error handling would turn a late 413 into a 500
+    if MAX_CONTENT_LENGTH and (request.content_length or 0) > MAX_CONTENT_LENGTH:
+        return request_too_large(None)
+    return None
+
+@app.before_request
+def acquire_request_slot():
+    if request_slots is None or request.endpoint in UNLIMITED_ENDPOINTS:
+        return None
+    if not request_slots.acquire(blocking=False):
+        logging.warning(f"Rejecting request, {MAX_CONCURRENT_REQUESTS} requests already in progress")
+        response = jsonify({"error": "Server busy, please retry", "retry_after": 1})
+        response.status_code = 503
+        response.headers["Retry-After"] = "1"
+        return response
+    g.request_slot = True
+    return None
+
+@app.teardown_request
+def release_request_slot(_error=None):
+    if g.pop("request_slot", False):
+        request_slots.release()
+
+@app.errorhandler(413)
+def request_too_large(_error):
+    logging.warning(f"Rejected {request.path} request larger than {MAX_CONTENT_LENGTH} bytes")
+    return jsonify({"error": f"Request too large (limit {MAX_CONTENT_LENGTH} bytes)"}), 413
 
 @app.route("/")
 def index():
-    return render_template("index.html")
+    return render_template(
+        "index.html",
+        client_max_dimension=CLIENT_MAX_DIMENSION,
+        live_analysis=app.config["LIVE_ANALYSIS"],
+    )
+
+def read_uploaded_image(context="analyze"):
+    """Decode the multipart 'image' upload, returning (image, error_response)"""
+    if 'image' not in request.files:
+        logging.warning(f"No image file in {context} request")
+        return None, (jsonify({"error": "No image uploaded"}), 400)
+
+    file = request.files['image']
+    if file.filename == '':
+        logging.warning(f"Empty filename in {context} request")
+        return None, (jsonify({"error": "No image selected"}), 400)
+
+    logging.debug(f"Processing image: {file.filename}, size: {file.content_length if hasattr(file, 'content_length') else 'unknown'} bytes")
+
+    try:
+        img = analyzer.decode_image(file.read())
+    except Exception as decode_err:
+        logging.error(f"Failed to decode image in {context}: {decode_err}")
+        return None, (jsonify({"error": "Failed to decode image file"}), 400)
+
+    if img is None:
+        logging.error(f"OpenCV failed to decode image in {context} - possibly invalid format")
+        return None, (jsonify({"error": "Invalid image format"}), 400)
+
+    logging.debug(f"Image decoded successfully for {context}: {img.shape}")
+    return img, None
+
+def read_chat_request():
+    """Resolve the question and image payload of a chat request
+
+    Returns (user_message, image_base64, image_id, error_response). The image
+    comes from the session named by 'image_id' or, failing that, from a fresh
+    upload which starts a new session.
+    """
+    if 'message' not in request.form:
+        logging.warning("No message in chat request")
+        return None, None, None, (jsonify({"error": "No message provided"}), 400)
+
+    user_message = request.form['message']
+    if not user_message.strip():
+        logging.warning("Empty message in chat request")
+        return None, None, None, (jsonify({"error": "No message provided"}), 400)
+
+    image_id = request.form.get('image_id')
+    if image_id:
+        image_base64 = image_store.get(image_id)
+        if image_base64 is None:
+            logging.warning(f"Unknown or expired image session: {image_id}")
+            return None, None, None, (jsonify({"error": "Image session expired", "expired": True}), 404)
+        logging.debug(f"Processing chat for image session: {image_id}, message: {user_message[:50]}...")
+        return user_message, image_base64, image_id, None
+
+    # Fall back to a one-off upload for clients without a session
+    img, error_response = read_uploaded_image("chat")
+    if error_response:
+        return None, None, None, error_response
+
+    image_base64 = analyzer.encode_image(img)
+    if image_base64 is None:
+        return None, None, None, (jsonify({"error": "Failed to encode image"}), 500)
+    return user_message, image_base64, image_store.put(image_base64), None
+
+def client_id():
+    """Identify the caller for per-client fairness in the scheduler"""
+    return request.headers.get("X-Client-ID") or request.remote_addr
+
+def saturated_response(err):
+    logging.warning(f"Rejecting request, scheduler saturated (retry after {err.retry_after}s)")
+    response = jsonify({"error": "Server busy, please retry", "retry_after": err.retry_after})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(err.retry_after)
+    return response
+
+def schedule_stream(events):
+    """Run a streaming generation on a scheduler worker
+
+    Events are handed back through a queue so the response can forward them
+    as they arrive. When the client goes away the generation is closed,
+    which drops its Ollama connection and frees the dispatch slot. Raises
+    SchedulerSaturated if the job cannot be queued.
+    """
+    channel = queue.Queue()
+    cancelled = threading.Event()
+
+    def pump():
+        try:
+            if cancelled.is_set():
+                return  # the client left while the job was queued
+            for event in events:
+                if cancelled.is_set():
+                    break
+                channel.put(event)
+        except Exception as e:
+            channel.put(e)
+        finally:
+            events.close()
+            channel.put(None)
+
+    scheduler.submit(None, client_id(), pump)
+
+    def drain():
+        try:
+            while True:
+                item = channel.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            cancelled.set()
+
+    return drain()
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def sse_response(events, context):
+    """Stream (event, data) pairs to the client as Server-Sent Events"""
+    def generate():
+        try:
+            for event, data in events:
+                yield sse_event(event, data)
+        except Exception as e:
+            logging.error(f"Streaming {context} failed: {e}")
+            yield sse_event("error", {"error": f"{context.capitalize()} failed: {str(e)}"})
+        finally:
+            events.close()  # on disconnect this cancels the scheduled generation
+
+    return Response(generate(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
 
 @app.route("/analyze", methods=["POST"])
 def analyze():
     try:
-        logging.info("Received analyze request")
+        logging.debug("Received analyze request")
         
-        if 'image' not in request.files:
-            logging.warning("No image file in request")
-            return jsonify({"error": "No image uploaded"}), 400
-            
-        file = request.files['image']
-        if file.filename == '':
-            logging.warning("Empty filename in request")
-            return jsonify({"error": "No image selected"}), 400
-            
-        logging.info(f"Processing image: {file.filename}, size: {file.content_length if hasattr(file, 'content_length') else 'unknown'} bytes")
+        img, error_response = read_uploaded_image()
+        if error_response:
+            return error_response
         
-        try:
-            file_bytes = np.frombuffer(file.read(), np.uint8)
-            img = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
-        except Exception as decode_err:
-            logging.error(f"Failed to decode image: {decode_err}")
-            return jsonify({"error": "Failed to decode image file"}), 400
-            
-        if img is None:
-            logging.error("OpenCV failed to decode image - possibly invalid format")
-            return jsonify({"error": "Invalid image format"}), 400
-            
-        logging.info(f"Image decoded successfully: {img.shape}")
-        
-        result = analyzer.analyze_image(img)
+        image_base64 = analyzer.encode_image(img)
+        if image_base64 is None:
+            return jsonify({"error": "Failed to encode image"}), 500
+
+        # Keep the prepared payload so follow-up chat turns only send the ID
+        image_id = image_store.put(image_base64)
+        frame_hash = analyzer.frame_hash(img)
+        key, result = analyzer.cached_analysis(image_base64, frame_hash)
+        if result is None:
+            # Identical in-flight images share one generation
+            future = scheduler.submit(key, client_id(), analyzer.run_analysis, image_base64, key, frame_hash)
+            result = dict(future.result())
         
         if result is None:
             logging.error("Analyzer returned None")
@@ -270,55 +1001,64 @@ def analyze():
             logging.error(f"Analysis error: {result['error']}")
             return jsonify(result), 500
             
-        logging.info("Analysis completed successfully")
+        logging.debug("Analysis completed successfully")
+        result["image_id"] = image_id
         return jsonify(result)
         
+    except SchedulerSaturated as err:
+        return saturated_response(err)
     except Exception as e:
         logging.error(f"Unexpected error in /analyze endpoint: {e}")
         traceback.print_exc()
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
+@app.route("/analyze/stream", methods=["POST"])
+def analyze_stream():
+    """Analyze an image, streaming tokens and parsed fields as they arrive"""
+    try:
+        logging.debug("Received streaming analyze request")
+
+        img, error_response = read_uploaded_image()
+        if error_response:
+            return error_response
+
+        image_base64 = analyzer.encode_image(img)
+        if image_base64 is None:
+            return jsonify({"error": "Failed to encode image"}), 500
+
+        image_id = image_store.put(image_base64)
+        frame_hash = analyzer.frame_hash(img)
+        key, cached = analyzer.cached_analysis(image_base64, frame_hash)
+        if cached is not None:
+            analysis = analyzer.replay_analysis(cached)
+        else:
+            analysis = schedule_stream(analyzer.stream_analysis(image_base64, key, frame_hash))
+
+        def events():
+            yield "session", {"image_id": image_id}
+            yield from analysis
+
+        return sse_response(events(), "analysis")
+
+    except SchedulerSaturated as err:
+        return saturated_response(err)
+    except Exception as e:
+        logging.error(f"Unexpected error in /analyze/stream endpoint: {e}")
+        traceback.print_exc()
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
 @app.route("/chat", methods=["POST"])
 def chat():
     """Handle chat messages about the uploaded image"""
     try:
-        logging.info("Received chat request")
+        logging.debug("Received chat request")
         
-        if 'image' not in request.files:
-            logging.warning("No image file in chat request")
-            return jsonify({"error": "No image uploaded"}), 400
-            
-        if 'message' not in request.form:
-            logging.warning("No message in chat request")
-            return jsonify({"error": "No message provided"}), 400
-            
-        file = request.files['image']
-        user_message = request.form['message']
-        
-        if file.filename == '':
-            logging.warning("Empty filename in chat request")
-            return jsonify({"error": "No image selected"}), 400
-            
-        if not user_message.strip():
-            logging.warning("Empty message in chat request")
-            return jsonify({"error": "No message provided"}), 400
-            
-        logging.info(f"Processing chat for image: {file.filename}, message: {user_message[:50]}...")
-        
-        try:
-            file_bytes = np.frombuffer(file.read(), np.uint8)
-            img = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
-        except Exception as decode_err:
-            logging.error(f"Failed to decode image in chat: {decode_err}")
-            return jsonify({"error": "Failed to decode image file"}), 400
-            
-        if img is None:
-            logging.error("OpenCV failed to decode image in chat - possibly invalid format")
-            return jsonify({"error": "Invalid image format"}), 400
-            
-        logging.info(f"Image decoded successfully for chat: {img.shape}")
-        
-        result = analyzer.chat_with_image(img, user_message)
+        user_message, image_base64, image_id, error_response = read_chat_request()
+        if error_response:
+            return error_response
+
+        future = scheduler.submit(None, client_id(), analyzer.chat_with_encoded, image_base64, user_message)
+        result = future.result()
         
         if result is None:
             logging.error("Chat analyzer returned None")
@@ -328,26 +1068,237 @@ def chat():
             logging.error(f"Chat error: {result['error']}")
             return jsonify(result), 500
             
-        logging.info("Chat completed successfully")
+        logging.debug("Chat completed successfully")
+        result["image_id"] = image_id
         return jsonify(result)
         
+    except SchedulerSaturated as err:
+        return saturated_response(err)
     except Exception as e:
         logging.error(f"Unexpected error in /chat endpoint: {e}")
         traceback.print_exc()
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
+@app.route("/chat/stream", methods=["POST"])
+def chat_stream():
+    """Handle chat messages, streaming the reply token by token"""
+    try:
+        logging.debug("Received streaming chat request")
+
+        user_message, image_base64, image_id, error_response = read_chat_request()
+        if error_response:
+            return error_response
+
+        chat_events = schedule_stream(analyzer.stream_chat(image_base64, user_message))
+
+        def events():
+            yield "session", {"image_id": image_id}
+            yield from chat_events
+
+        return sse_response(events(), "chat")
+
+    except SchedulerSaturated as err:
+        return saturated_response(err)
+    except Exception as e:
+        logging.error(f"Unexpected error in /chat/stream endpoint: {e}")
+        traceback.print_exc()
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+def resolve_batch_path(path):
+    """Resolve a client-supplied path inside BATCH_ROOT, or return None"""
+    if not BATCH_ROOT:
+        return None
+    root = os.path.realpath(BATCH_ROOT)
+    resolved = os.path.realpath(os.path.join(root, path))
+    return resolved if os.path.commonpath([root, resolved]) == root else None
+
+@app.route("/batch", methods=["POST"])
+def batch():
+    """Analyze many images, streaming one NDJSON result row per image
+
+    Accepts either a zip upload ('archive') or a JSON body naming a 'source'
+    folder/zip or a list of 'paths' under BATCH_ROOT. With an 'output' file
+    (JSONL or CSV) rows are also appended there and a repeated request
+    resumes by skipping images that already succeeded.
+    """
+    upload_path = None
+    try:
+        body = request.get_json(silent=True) or {}
+        try:
+            concurrency = int(body.get("concurrency", BATCH_CONCURRENCY))
+        except (TypeError, ValueError):
+            return jsonify({"error": "concurrency must be an integer"}), 400
+        concurrency = max(1, min(concurrency, SCHEDULER_MAX_PER_CLIENT))
+        if body.get("format") not in (None, *OUTPUT_FORMATS):
+            return jsonify({"error": f"format must be one of {', '.join(OUTPUT_FORMATS)}"}), 400
+        writer = None
+        if 'archive' in request.files:
+            with tempfile.NamedTemporaryFile(suffix=".zip", delete=False) as upload:
+                request.files['archive'].save(upload)
+            upload_path = upload.name
+            if not zipfile.is_zipfile(upload_path):
+                os.unlink(upload_path)
+                return jsonify({"error": "Archive must be a zip file"}), 400
+            items = collect_items([upload_path])
+        else:
+            sources = body.get("paths") or ([body["source"]] if body.get("source") else [])
+            if not sources:
+                return jsonify({"error": "No archive or paths provided"}), 400
+            resolved = [resolve_batch_path(source) for source in sources]
+            output = resolve_batch_path(body["output"]) if body.get("output") else None
+            if None in resolved or (body.get("output") and output is None):
+                logging.warning("Rejected batch request for paths outside BATCH_ROOT")
+                return jsonify({"error": "Paths must be inside BATCH_ROOT"}), 403
+            items = collect_items(resolved)
+            if output:
+                writer = BatchWriter(output, FIELD_PATTERNS, body.get("format"))
+
+        # Batch jobs queue as their own scheduler client, so interactive
+        # requests still get their round-robin turn between them
+        batch_client = f"batch-{client_id()}"
+
+        def submit(image_base64):
+            while True:
+                try:
+                    return scheduler.submit(None, batch_client, analyzer.analyze_encoded, image_base64)
+                except SchedulerSaturated as err:
+                    time.sleep(err.retry_after)
+
+        runner = BatchRunner(submit, FIELD_PATTERNS, preprocessor, concurrency, BATCH_DECODE_WORKERS)
+        logging.info(f"Starting batch of {len(items)} image(s) with concurrency {concurrency}")
+
+        def rows():
+            try:
+                for row in run_batch(runner, items, writer):
+                    yield json.dumps(row) + "\n"
+            finally:
+                if writer is not None:
+                    writer.close()
+                if upload_path:
+                    os.unlink(upload_path)
+
+        return Response(rows(), mimetype="application/x-ndjson")
+
+    except Exception as e:
+        if upload_path and os.path.exists(upload_path):
+            os.unlink(upload_path)
+        logging.error(f"Unexpected error in /batch endpoint: {e}")
+        traceback.print_exc()
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+VIDEO_OPTIONS = {
+    "probe_fps": 4.0,
+    "histogram_threshold": 0.3,
+    "difference_threshold": 0.12,
+    "min_interval": 1.0,
+    "max_interval": 30.0,
+}
+
+@app.route("/video", methods=["POST"])
+def video():
+    """Analyze a video at its scene changes, streaming NDJSON timeline events
+
+    Accepts a 'video' upload or a JSON body with a 'source' under
+    BATCH_ROOT. Optional parameters: probe_fps, histogram_threshold,
+    difference_threshold, min_interval, max_interval.
+    """
+    upload_path = None
+    try:
+        params = request.get_json(silent=True) or request.form
+        options = {}
+        for name, default in VIDEO_OPTIONS.items():
+            try:
+                options[name] = float(params.get(name, default))
+            except (TypeError, ValueError):
+                options[name] = math.nan
+            if not math.isfinite(options[name]):
+                return jsonify({"error": f"{name} must be a number"}), 400
+
+        if 'video' in request.files:
+            file = request.files['video']
+            suffix = os.path.splitext(file.filename or "")[1] or ".mp4"
+            with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as upload:
+                file.save(upload)
+            upload_path = path = upload.name
+        elif params.get("source"):
+            path = resolve_batch_path(params["source"])
+            if path is None:
+                logging.warning("Rejected video request for a path outside BATCH_ROOT")
+                return jsonify({"error": "Paths must be inside BATCH_ROOT"}), 403
+        else:
+            return jsonify({"error": "No video provided"}), 400
+
+        capture = cv2.VideoCapture(path)
+        if not capture.isOpened():
+            capture.release()
+            if upload_path:
+                os.unlink(upload_path)
+            return jsonify({"error": "Cannot read video"}), 400
+
+        probe_fps = options.pop("probe_fps")
+        sampler = SceneSampler(**options)
+        video_client = f"video-{client_id()}"
+        concurrency = max(1, min(BATCH_CONCURRENCY, SCHEDULER_MAX_PER_CLIENT))
+
+        def submit(frame):
+            while True:
+                try:
+                    return scheduler.submit(None, video_client, analyzer.analyze_image, frame)
+                except SchedulerSaturated as err:
+                    time.sleep(err.retry_after)
+
+        def events():
+            try:
+                for event in analyze_video(capture, submit, FIELD_PATTERNS, sampler, probe_fps, concurrency):
+                    yield json.dumps(event) + "\n"
+            finally:
+                capture.release()
+                if upload_path:
+                    os.unlink(upload_path)
+
+        return Response(events(), mimetype="application/x-ndjson")
+
+    except Exception as e:
+        if upload_path and os.path.exists(upload_path):
+            os.unlink(upload_path)
+        logging.error(f"Unexpected error in /video endpoint: {e}")
+        traceback.print_exc()
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+@app.route("/cache/stats")
+def cache_stats():
+    """Expose result cache hit/miss counters for tuning"""
+    stats = {"enabled": result_cache is not None}
+    if result_cache is not None:
+        stats.update(result_cache.stats())
+    if near_duplicates is not None:
+        stats["near_duplicate"] = near_duplicates.stats()
+    return jsonify(stats)
+
+@app.route("/backends/stats")
+def backend_stats():
+    """Expose health, load and models of each Ollama backend"""
+    return jsonify(backends.stats())
+
+@app.route("/scheduler/stats")
+def scheduler_stats():
+    """Expose queue depth and coalescing counters of the analysis scheduler"""
+    return jsonify(scheduler.stats())
+
+@app.route("/metrics")
+def prometheus_metrics():
+    """Prometheus scrape endpoint: stage latencies, Ollama timings, retries, cache hits"""
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
 if __name__ == "__main__":
+    # Development server only; in production run:  gunicorn -c gunicorn.conf.py app:app
     logging.info("=== Real-time Scene Analyzer Starting ===")
-    logging.info(f"Ollama API URL: {OLLAMA_API_URL}")
-    logging.info(f"Model: {MODEL_NAME}")
-    
-    # Test API connection at startup
-    if not test_api_connection():
-        logging.warning("⚠️  Ollama API is not reachable. Please ensure:")
-        logging.warning("   1. Ollama is installed and running")
-        logging.warning("   2. The model 'llava:7b' is available (run: ollama pull llava:7b)")
-        logging.warning("   3. API URL is correct: " + OLLAMA_API_URL)
-        logging.warning("   Server will start anyway, but image analysis will fail.")
-    
-    logging.info("Starting Flask server on http://localhost:5000")
-    app.run(debug=True, host="0.0.0.0", port=5000)
+    init_worker()
+
+    debug = os.getenv("FLASK_DEBUG", "false").lower() in ("1", "true", "yes")
+    logging.info("Starting Flask development server on http://localhost:5000")
+    try:
+        app.run(debug=debug, use_reloader=False, threaded=True, host="0.0.0.0", port=5000)
+    finally:
+        shutdown_worker()
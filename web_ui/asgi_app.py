@@ -0,0 +1,697 @@
+"""Asyncio serving path for the scene analyzer.
+
+The Ollama-bound routes (/analyze, /chat and their streaming variants) are
+served natively with a pooled keep-alive httpx client, so a waiting client
+costs a coroutine rather than a worker thread. An AsyncAnalysisScheduler
+caps the in-flight Ollama requests, shares one generation between
+identical analyses, serves clients round-robin and answers 429 once its
+queue is full. /ws/live adds a latest-frame-wins
+WebSocket for continuous analysis. Every other route (index page, static
+files, stats) falls through to the Flask app. MAX_CONTENT_LENGTH and
+MAX_CONCURRENT_REQUESTS apply to every route as they do on the Flask app.
+
+Run with:  uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+For several processes add --workers N (each worker runs its own startup)
+and --timeout-graceful-shutdown to let in-flight Ollama calls finish on
+SIGTERM.
+"""
+import asyncio
+import json
+import logging
+import time
+import traceback
+from contextlib import asynccontextmanager
+
+import cv2
+import httpx
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import UploadFile
+from starlette.middleware import Middleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route, WebSocketRoute
+from starlette.websockets import WebSocketDisconnect
+
+import app as web_app
+import metrics
+from app import (
+    ANALYSIS_PROMPT,
+    ANALYSIS_REQUEST,
+    CHAT_PROMPT,
+    MAX_CONCURRENT_REQUESTS,
+    MAX_CONTENT_LENGTH,
+    MODEL_NAME,
+    OLLAMA_KEEP_ALIVE,
+    OLLAMA_MAX_INFLIGHT,
+    OLLAMA_POOL_SIZE,
+    RETRYABLE_STATUSES,
+    SCHEDULER_MAX_PER_CLIENT,
+    SCHEDULER_MAX_QUEUE,
+    NoBackendAvailable,
+    OllamaError,
+    analyzer,
+    backend_at_fault,
+    backends,
+    generation_finished,
+    image_store,
+    latency_tracker,
+    retry_policy,
+    sse_event,
+)
+from scheduler import AsyncAnalysisScheduler, SchedulerSaturated
+
+ollama_client = None
+ollama_scheduler = None
+
+# === Ollama Client ===
+async def send_leased_async(backend, path, payload, timeout, stream=False):
+    """Async counterpart of app.send_leased, returning (response, retryable)"""
+    url = backend.url + path
+    success, handed_off = False, False
+    started = time.monotonic()
+    try:
+        logging.debug(f"Sending async API call to {url}")
+        request = ollama_client.build_request(
+            "POST", url, json=payload,
+            timeout=httpx.Timeout(timeout[1], connect=timeout[0]),
+        )
+        response = await ollama_client.send(request, stream=stream)
+        try:
+            response.raise_for_status()
+        except httpx.HTTPStatusError:
+            if stream:
+                await response.aread()
+            await response.aclose()
+            raise
+        success = True
+        if stream:
+            response.backend = backend
+            handed_off = True
+        else:
+            latency_tracker.record(time.monotonic() - started)
+        return response, False
+    except httpx.HTTPStatusError as http_err:
+        status = http_err.response.status_code
+        logging.error(f"HTTP error from {url}: {http_err} - Status: {status}")
+        if status >= 500:
+            logging.error(f"Server error response: {http_err.response.text[:200]}")
+        success = not backend_at_fault(status)
+        return None, status in RETRYABLE_STATUSES
+    except asyncio.CancelledError:
+        success = True  # cancelled by us (lost a hedge race), not a backend fault
+        raise
+    except httpx.TimeoutException as timeout_err:
+        logging.error(f"Timeout error from {url}: {timeout_err}")
+    except httpx.TransportError as conn_err:
+        logging.error(f"Connection error from {url}: {conn_err}")
+    except Exception as e:
+        logging.error(f"Unexpected error from {url}: {e}")
+    finally:
+        if not handed_off:
+            backends.release(backend, success)
+    return None, True
+
+async def hedged_post_async(backend, path, payload, timeout, remaining):
+    """Async counterpart of app.hedged_post; the losing request is cancelled"""
+    hedge_after = latency_tracker.percentile(retry_policy.hedge_percentile)
+    primary = asyncio.create_task(send_leased_async(backend, path, payload, timeout))
+    if hedge_after is None or hedge_after >= remaining:
+        return await primary
+    done, _ = await asyncio.wait({primary}, timeout=hedge_after)
+    if done:
+        return primary.result()
+
+    try:
+        second_backend = backends.acquire(payload.get("model", MODEL_NAME), exclude=(backend,))
+    except NoBackendAvailable:
+        return await primary
+    logging.info(f"Request slower than p{retry_policy.hedge_percentile:g} ({hedge_after:.2f}s), hedging to {second_backend.url}")
+    metrics.OLLAMA_HEDGES.inc()
+    secondary = asyncio.create_task(send_leased_async(second_backend, path, payload, timeout))
+
+    pending = {primary, secondary}
+    outcome = (None, True)
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            response, retryable = task.result()
+            if response is not None:
+                for loser in pending:
+                    loser.cancel()
+                return response, False
+            outcome = (None, outcome[1] and retryable)
+    return outcome
+
+async def retry_post_async(path, payload, stream=False):
+    """Async counterpart of app.retry_post using the shared httpx client"""
+    model = payload.get("model", MODEL_NAME)
+    deadline_at = time.monotonic() + retry_policy.deadline
+    hedge = not stream and retry_policy.hedge_percentile > 0 and len(backends) > 1
+    attempt = 0
+    while attempt < retry_policy.max_attempts:
+        attempt += 1
+        remaining = deadline_at - time.monotonic()
+        if remaining <= 0:
+            break
+        timeout = retry_policy.timeout(remaining)
+
+        try:
+            backend = backends.acquire(model)
+        except NoBackendAvailable as e:
+            logging.error(f"No backend for attempt {attempt}/{retry_policy.max_attempts}: {e}")
+            metrics.record_attempt("no_backend")
+            response, retryable = None, True
+        else:
+            logging.debug(f"Attempting async API call {attempt}/{retry_policy.max_attempts} to {backend.url}")
+            if hedge:
+                response, retryable = await hedged_post_async(backend, path, payload, timeout, remaining)
+            else:
+                response, retryable = await send_leased_async(backend, path, payload, timeout, stream)
+            metrics.record_attempt("success" if response is not None else "retryable" if retryable else "fatal")
+
+        if response is not None:
+            logging.debug(f"✓ API call successful on attempt {attempt}")
+            return response
+        if not retryable:
+            logging.error("API call failed with a non-retryable error")
+            return None
+
+        delay = retry_policy.backoff(attempt)
+        if attempt < retry_policy.max_attempts and time.monotonic() + delay < deadline_at:
+            logging.debug(f"Waiting {delay:.2f} seconds before retry...")
+            await asyncio.sleep(delay)
+
+    logging.error(f"API call failed after {attempt} attempt(s) within the {retry_policy.deadline:g}s deadline")
+    return None
+
+async def generate_async(prompt, image_base64, extra=None):
+    """Send a single generation request and return (output, error)
+
+    Run it through ollama_scheduler, which provides the dispatch slot.
+    """
+    payload = {
+        "model": MODEL_NAME,
+        "prompt": prompt,
+        "images": [image_base64],
+        "stream": False,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+        **(extra or {}),
+    }
+
+    started = time.perf_counter()
+    response = await retry_post_async("/api/generate", payload)
+    metrics.observe_stage("generation", time.perf_counter() - started)
+
+    if response is None:
+        return None, "API connection failed after retries"
+
+    content_type = response.headers.get('Content-Type', '')
+    if 'application/json' not in content_type:
+        logging.error(f"Unexpected content type: {content_type}")
+        return None, f"Invalid API response format: {content_type}"
+
+    try:
+        response_data = response.json()
+    except ValueError as json_err:
+        logging.error(f"Error parsing JSON: {json_err}")
+        return None, "Invalid JSON response from API"
+
+    output = response_data.get("response", "")
+    if not output:
+        logging.warning("Empty response from API")
+        return None, "Empty response from API"
+    generation_finished(response_data)
+    return output, None
+
+async def stream_generate_async(client_id, prompt, image_base64, extra=None):
+    """Yield response tokens as Ollama produces them
+
+    Waits for a dispatch slot of ``client_id`` first; raises
+    SchedulerSaturated if none can be queued.
+    """
+    payload = {
+        "model": MODEL_NAME,
+        "prompt": prompt,
+        "images": [image_base64],
+        "stream": True,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+        **(extra or {}),
+    }
+
+    # Hold the slot for the whole generation, not just until the headers arrive
+    async with ollama_scheduler.slot(client_id):
+        started = time.perf_counter()
+        response = await retry_post_async("/api/generate", payload, stream=True)
+        if response is None:
+            raise OllamaError("API connection failed after retries")
+
+        success = False
+        try:
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                try:
+                    chunk = json.loads(line)
+                except ValueError:
+                    raise OllamaError("Invalid JSON in streamed response")
+                if "error" in chunk:
+                    raise OllamaError(chunk["error"])
+                token = chunk.get("response", "")
+                if token:
+                    yield token
+                if chunk.get("done"):
+                    generation_finished(chunk, response.backend.url)
+                    break
+            success = True
+            metrics.observe_stage("generation", time.perf_counter() - started)
+        except (GeneratorExit, asyncio.CancelledError):
+            success = True  # the client went away, not the backend
+            raise
+        finally:
+            await response.aclose()
+            backends.release(response.backend, success)
+
+# === Request Limits ===
+class RequestLimits:
+    """ASGI counterpart of the Flask app's body size limit and request cap
+
+    A body larger than ``max_body`` bytes gets a 413, whether its
+    Content-Length announces it or it only shows while being read. Once
+    ``max_concurrent`` requests are in progress, new ones get a 503 with
+    Retry-After; paths starting with one of ``unlimited`` are not counted.
+    """
+
+    def __init__(self, app, max_body=0, max_concurrent=0, unlimited=("/static/", "/metrics")):
+        self.app = app
+        self.max_body = max_body
+        self.max_concurrent = max_concurrent
+        self.unlimited = unlimited
+        self.active = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        # Checked up front: the routes' own error handling would turn a late 413 into a 500
+        if self.max_body and int(dict(scope["headers"]).get(b"content-length", 0)) > self.max_body:
+            await self.too_large(scope["path"])(scope, receive, send)
+            return
+
+        counted = self.max_concurrent > 0 and not scope["path"].startswith(self.unlimited)
+        if counted and self.active >= self.max_concurrent:
+            logging.warning(f"Rejecting request, {self.max_concurrent} requests already in progress")
+            busy = JSONResponse(
+                {"error": "Server busy, please retry", "retry_after": 1},
+                status_code=503, headers={"Retry-After": "1"},
+            )
+            await busy(scope, receive, send)
+            return
+
+        state = {"received": 0, "overflow": False, "started": False, "replaced": False}
+
+        async def receive_limited():
+            message = await receive()
+            if self.max_body and message["type"] == "http.request":
+                state["received"] += len(message.get("body", b""))
+                if state["received"] > self.max_body:
+                    state["overflow"] = True
+                    return {"type": "http.disconnect"}  # stop the route reading any further
+            return message
+
+        async def send_checked(message):
+            if state["overflow"] and not state["started"]:
+                # Answer with the 413 instead of the route's error for the cut-off body
+                state["started"] = state["replaced"] = True
+                await self.too_large(scope["path"])(scope, receive, send)
+            if state["replaced"]:
+                return
+            state["started"] = True
+            await send(message)
+
+        if counted:
+            self.active += 1
+        try:
+            await self.app(scope, receive_limited, send_checked)
+        finally:
+            if counted:
+                self.active -= 1
+
+    def too_large(self, path):
+        logging.warning(f"Rejected {path} request larger than {self.max_body} bytes")
+        return JSONResponse({"error": f"Request too large (limit {self.max_body} bytes)"}, status_code=413)
+
+# === Request Helpers ===
+def client_id(connection):
+    """Async counterpart of app.client_id, for requests and WebSockets"""
+    return connection.headers.get("X-Client-ID") or (connection.client.host if connection.client else "unknown")
+
+def saturated_response(err):
+    logging.warning(f"Rejecting request, scheduler saturated (retry after {err.retry_after}s)")
+    return JSONResponse(
+        {"error": "Server busy, please retry", "retry_after": err.retry_after},
+        status_code=429, headers={"Retry-After": str(err.retry_after)},
+    )
+
+async def read_uploaded_image(form, context="analyze"):
+    """Decode the multipart 'image' upload, returning (image, error_response)"""
+    upload = form.get("image")
+    if not isinstance(upload, UploadFile):
+        logging.warning(f"No image file in {context} request")
+        return None, JSONResponse({"error": "No image uploaded"}, status_code=400)
+    if not upload.filename:
+        logging.warning(f"Empty filename in {context} request")
+        return None, JSONResponse({"error": "No image selected"}, status_code=400)
+
+    data = await upload.read()
+    try:
+        img = await run_in_threadpool(analyzer.decode_image, data)
+    except Exception as decode_err:
+        logging.error(f"Failed to decode image in {context}: {decode_err}")
+        return None, JSONResponse({"error": "Failed to decode image file"}, status_code=400)
+
+    if img is None:
+        logging.error(f"OpenCV failed to decode image in {context} - possibly invalid format")
+        return None, JSONResponse({"error": "Invalid image format"}, status_code=400)
+    return img, None
+
+async def read_chat_request(form):
+    """Async counterpart of app.read_chat_request"""
+    user_message = form.get("message")
+    if not isinstance(user_message, str) or not user_message.strip():
+        logging.warning("No message in chat request")
+        return None, None, None, JSONResponse({"error": "No message provided"}, status_code=400)
+
+    image_id = form.get("image_id")
+    if image_id:
+        image_base64 = await run_in_threadpool(image_store.get, image_id)
+        if image_base64 is None:
+            logging.warning(f"Unknown or expired image session: {image_id}")
+            return None, None, None, JSONResponse({"error": "Image session expired", "expired": True}, status_code=404)
+        return user_message, image_base64, image_id, None
+
+    img, error_response = await read_uploaded_image(form, "chat")
+    if error_response:
+        return None, None, None, error_response
+
+    image_base64 = await run_in_threadpool(analyzer.encode_image, img)
+    if image_base64 is None:
+        return None, None, None, JSONResponse({"error": "Failed to encode image"}, status_code=500)
+    return user_message, image_base64, await run_in_threadpool(image_store.put, image_base64), None
+
+async def prepare_upload(form):
+    """Decode, encode and hash an analyze upload, returning (prepared, error_response)"""
+    img, error_response = await read_uploaded_image(form)
+    if error_response:
+        return None, error_response
+
+    def prepare():
+        return analyzer.encode_image(img), analyzer.frame_hash(img)
+
+    image_base64, frame_hash = await run_in_threadpool(prepare)
+    if image_base64 is None:
+        return None, JSONResponse({"error": "Failed to encode image"}, status_code=500)
+    return (image_base64, frame_hash, await run_in_threadpool(image_store.put, image_base64)), None
+
+async def analyze_prepared(image_base64, frame_hash, client):
+    """Return a cached or freshly generated analysis, or {"error": ...}
+
+    Identical in-flight analyses share one generation. Raises
+    SchedulerSaturated when the request cannot be queued.
+    """
+    key, result = await run_in_threadpool(analyzer.cached_analysis, image_base64, frame_hash)
+    if result is not None:
+        return result
+    result = await ollama_scheduler.run(key, client, analyze_uncached, image_base64, key, frame_hash)
+    return dict(result)
+
+async def analyze_uncached(image_base64, key, frame_hash):
+    output, error = await generate_async(ANALYSIS_PROMPT, image_base64, ANALYSIS_REQUEST)
+    if error:
+        logging.error(f"Analysis error: {error}")
+        return {"error": error}
+    result = analyzer.parse_analysis(output)
+    result["raw_response"] = output
+    await run_in_threadpool(analyzer.store_analysis, key, frame_hash, result)
+    return result
+
+def prepare_frame(data):
+    """Decode, encode and hash raw frame bytes; returns (None, None) if unreadable"""
+    img = analyzer.decode_image(data)
+    if img is None:
+        return None, None
+    return analyzer.encode_image(img), analyzer.frame_hash(img)
+
+def sse_response(events, context):
+    """Stream async (event, data) pairs to the client as Server-Sent Events"""
+    async def generate():
+        try:
+            async for event, data in events:
+                yield sse_event(event, data)
+        except Exception as e:
+            logging.error(f"Streaming {context} failed: {e}")
+            yield sse_event("error", {"error": f"{context.capitalize()} failed: {str(e)}"})
+
+    return StreamingResponse(generate(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+# === Routes ===
+async def analyze(request):
+    try:
+        form = await request.form()
+        prepared, error_response = await prepare_upload(form)
+        if error_response:
+            return error_response
+        image_base64, frame_hash, image_id = prepared
+
+        result = await analyze_prepared(image_base64, frame_hash, client_id(request))
+        if "error" in result:
+            return JSONResponse(result, status_code=500)
+
+        result["image_id"] = image_id
+        return JSONResponse(result)
+
+    except SchedulerSaturated as err:
+        return saturated_response(err)
+    except cv2.error as cv_err:
+        logging.error(f"OpenCV error during image processing: {cv_err}")
+        return JSONResponse({"error": "Image processing failed"}, status_code=500)
+    except Exception as e:
+        logging.error(f"Unexpected error in /analyze endpoint: {e}")
+        traceback.print_exc()
+        return JSONResponse({"error": f"Server error: {str(e)}"}, status_code=500)
+
+async def analyze_stream(request):
+    try:
+        client = client_id(request)
+        ollama_scheduler.check(client)
+        form = await request.form()
+        prepared, error_response = await prepare_upload(form)
+        if error_response:
+            return error_response
+        image_base64, frame_hash, image_id = prepared
+
+        async def events():
+            yield "session", {"image_id": image_id}
+            key, cached = await run_in_threadpool(analyzer.cached_analysis, image_base64, frame_hash)
+            if cached is not None:
+                for event in analyzer.replay_analysis(cached):
+                    yield event
+                return
+
+            parser = analyzer.stream_parser()
+            tokens = stream_generate_async(client, ANALYSIS_PROMPT, image_base64, ANALYSIS_REQUEST)
+            try:
+                async for token in tokens:
+                    yield "token", {"token": token}
+                    for name, value in parser.feed(token):
+                        yield "field", {"name": name, "value": value}
+                    if parser.complete:
+                        break  # every field is in, stop the generation
+            finally:
+                await tokens.aclose()
+            for name, value in parser.finish():
+                yield "field", {"name": name, "value": value}
+            yield "done", await run_in_threadpool(analyzer.finish_analysis, key, frame_hash, parser.output)
+
+        return sse_response(events(), "analysis")
+
+    except SchedulerSaturated as err:
+        return saturated_response(err)
+    except Exception as e:
+        logging.error(f"Unexpected error in /analyze/stream endpoint: {e}")
+        traceback.print_exc()
+        return JSONResponse({"error": f"Server error: {str(e)}"}, status_code=500)
+
+async def chat(request):
+    try:
+        form = await request.form()
+        user_message, image_base64, image_id, error_response = await read_chat_request(form)
+        if error_response:
+            return error_response
+
+        output, error = await ollama_scheduler.run(
+            None, client_id(request), generate_async, CHAT_PROMPT.format(question=user_message), image_base64,
+        )
+        if error:
+            logging.error(f"Chat error: {error}")
+            return JSONResponse({"error": error}, status_code=500)
+        return JSONResponse({"response": output, "image_id": image_id})
+
+    except SchedulerSaturated as err:
+        return saturated_response(err)
+    except Exception as e:
+        logging.error(f"Unexpected error in /chat endpoint: {e}")
+        traceback.print_exc()
+        return JSONResponse({"error": f"Server error: {str(e)}"}, status_code=500)
+
+async def chat_stream(request):
+    try:
+        client = client_id(request)
+        ollama_scheduler.check(client)
+        form = await request.form()
+        user_message, image_base64, image_id, error_response = await read_chat_request(form)
+        if error_response:
+            return error_response
+
+        async def events():
+            yield "session", {"image_id": image_id}
+            output = ""
+            async for token in stream_generate_async(client, CHAT_PROMPT.format(question=user_message), image_base64):
+                output += token
+                yield "token", {"token": token}
+            if not output:
+                raise OllamaError("Empty response from API")
+            yield "done", {"response": output}
+
+        return sse_response(events(), "chat")
+
+    except SchedulerSaturated as err:
+        return saturated_response(err)
+    except Exception as e:
+        logging.error(f"Unexpected error in /chat/stream endpoint: {e}")
+        traceback.print_exc()
+        return JSONResponse({"error": f"Server error: {str(e)}"}, status_code=500)
+
+async def live(websocket):
+    """Continuous analysis of a stream of frames, newest frame wins
+
+    The client sends frames as binary JPEG/PNG messages. While a generation
+    is in flight, newer frames overwrite the pending one, so at most one
+    frame waits and stale frames are dropped instead of piling up. Each
+    result is pushed back as a JSON message tagged with its frame number.
+    """
+    await websocket.accept()
+    client = client_id(websocket)
+    # One image session per socket, holding the latest analysed frame, so a
+    # live camera does not push other users' sessions out of the store
+    session = {"image_id": None}
+    pending = {"frame": None, "seq": 0, "dropped": 0}
+    frame_ready = asyncio.Event()
+
+    async def receive_frames():
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            data = message.get("bytes")
+            if not data:
+                continue
+            if MAX_CONTENT_LENGTH and len(data) > MAX_CONTENT_LENGTH:
+                logging.warning(f"Closing live session, frame larger than {MAX_CONTENT_LENGTH} bytes")
+                await websocket.close(code=1009)  # message too big
+                return
+            if pending["frame"] is not None:
+                pending["dropped"] += 1
+            pending["frame"] = data
+            pending["seq"] += 1
+            frame_ready.set()
+
+    async def analyze_frames():
+        while True:
+            await frame_ready.wait()
+            frame_ready.clear()
+            data, seq = pending["frame"], pending["seq"]
+            pending["frame"] = None
+
+            try:
+                image_base64, frame_hash = await run_in_threadpool(prepare_frame, data)
+                if image_base64 is None:
+                    result = {"error": "Invalid image format"}
+                else:
+                    result = await analyze_prepared(image_base64, frame_hash, client)
+                    session["image_id"] = await run_in_threadpool(image_store.put, image_base64, session["image_id"])
+                    result["image_id"] = session["image_id"]
+            except SchedulerSaturated as err:
+                result = {"error": "Server busy, please retry", "retry_after": err.retry_after}
+            except cv2.error as cv_err:
+                logging.error(f"OpenCV error during live frame processing: {cv_err}")
+                result = {"error": "Image processing failed"}
+
+            result.update(type="result", frame=seq, dropped=pending["dropped"])
+            await websocket.send_json(result)
+
+    logging.info("Live analysis session started")
+    tasks = [asyncio.create_task(receive_frames()), asyncio.create_task(analyze_frames())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if not task.cancelled() and task.exception() and not isinstance(task.exception(), WebSocketDisconnect):
+                logging.error(f"Live analysis failed: {task.exception()}")
+    finally:
+        # Cancelling also aborts any generation still waiting on Ollama
+        for task in tasks:
+            task.cancel()
+        logging.info(f"Live analysis session ended ({pending['seq']} frames, {pending['dropped']} dropped)")
+
+async def scheduler_stats(_request):
+    """Queue depth and coalescing counters of the async dispatch scheduler"""
+    return JSONResponse(ollama_scheduler.stats())
+
+@asynccontextmanager
+async def lifespan(_app):
+    global ollama_client, ollama_scheduler
+    ollama_client = httpx.AsyncClient(
+        timeout=httpx.Timeout(retry_policy.read_timeout, connect=retry_policy.connect_timeout),
+        limits=httpx.Limits(max_connections=OLLAMA_POOL_SIZE, max_keepalive_connections=OLLAMA_POOL_SIZE),
+    )
+    ollama_scheduler = AsyncAnalysisScheduler(
+        concurrency=OLLAMA_MAX_INFLIGHT,
+        max_queue=SCHEDULER_MAX_QUEUE,
+        max_per_client=SCHEDULER_MAX_PER_CLIENT,
+        observe=metrics.observe_stage,
+    )
+    logging.info(f"Async Ollama client ready (pool: {OLLAMA_POOL_SIZE}, max in-flight: {OLLAMA_MAX_INFLIGHT})")
+    # Runs in every uvicorn worker process
+    await run_in_threadpool(web_app.init_worker)
+    try:
+        yield
+    finally:
+        await run_in_threadpool(web_app.shutdown_worker)
+        await ollama_client.aclose()
+
+web_app.app.config["LIVE_ANALYSIS"] = True  # the index page shows the live toggle
+
+app = Starlette(
+    routes=[
+        Route("/analyze", analyze, methods=["POST"]),
+        Route("/analyze/stream", analyze_stream, methods=["POST"]),
+        Route("/chat", chat, methods=["POST"]),
+        Route("/chat/stream", chat_stream, methods=["POST"]),
+        Route("/scheduler/stats", scheduler_stats),
+        WebSocketRoute("/ws/live", live),
+        Mount("/", WSGIMiddleware(web_app.app)),
+    ],
+    middleware=[
+        Middleware(RequestLimits, max_body=MAX_CONTENT_LENGTH, max_concurrent=MAX_CONCURRENT_REQUESTS),
+    ],
+    lifespan=lifespan,
+)
+
+if __name__ == "__main__":
+    import uvicorn
+
+    logging.info("=== Real-time Scene Analyzer Starting (async) ===")
+    uvicorn.run(app, host="0.0.0.0", port=5000, timeout_graceful_shutdown=int(web_app.SHUTDOWN_DRAIN_TIMEOUT))
@@ -0,0 +1,257 @@
+"""Batch analysis of image folders, zip archives and path lists.
+
+Images are decoded and encoded in a thread pool, analysed with bounded
+concurrency, and each result row is appended to a JSONL or CSV file as
+soon as it is ready. Rerunning with the same output skips every image that
+already has a successful row, so an interrupted run picks up where it
+stopped.
+
+Run with:  python batch.py /data/stills --output stills.jsonl --concurrency 2
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff"}
+OUTPUT_FORMATS = ("jsonl", "csv")
+
+
+def is_image_name(name):
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+
+def collect_items(sources):
+    """Expand directories, zip archives and plain paths into (name, path, member) items
+
+    ``member`` is the entry inside a zip archive, or None for plain files.
+    Items are sorted within each source so reruns visit them in the same order.
+    """
+    items = []
+    for source in sources:
+        if os.path.isdir(source):
+            for root, _, files in os.walk(source):
+                for filename in files:
+                    if is_image_name(filename):
+                        path = os.path.join(root, filename)
+                        items.append((os.path.relpath(path, source), path, None))
+        elif zipfile.is_zipfile(source):
+            with zipfile.ZipFile(source) as archive:
+                for member in archive.namelist():
+                    if not member.endswith("/") and is_image_name(member):
+                        items.append((member, source, member))
+        else:
+            items.append((source, source, None))
+    return sorted(items, key=lambda item: (item[1], item[0]))
+
+
+def prepare_item(item, preprocessor, open_archive):
+    """Read, decode and encode one item: (name, image_base64, error)
+
+    ``open_archive(path)`` returns the ZipFile a zip member is read from.
+    """
+    name, path, member = item
+    try:
+        if member is None:
+            with open(path, "rb") as f:
+                data = f.read()
+        else:
+            data = open_archive(path).read(member)
+    except (OSError, KeyError, zipfile.BadZipFile) as e:
+        return name, None, f"Failed to read image: {e}"
+
+    image = preprocessor.decode(data)
+    if image is None:
+        return name, None, "Invalid image format"
+    image_base64 = preprocessor.encode(image)
+    if image_base64 is None:
+        return name, None, "Failed to encode image"
+    return name, image_base64, None
+
+
+def parse_json_row(line):
+    """Parse a JSONL row; a line cut short by an interrupted run yields None"""
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+class BatchWriter:
+    """Append result rows to a JSONL or CSV file, flushing after each row"""
+
+    def __init__(self, path, fields, fmt=None):
+        self.path = path
+        self.fields = ["name", *fields, "error"]
+        self.format = fmt or ("csv" if path.lower().endswith(".csv") else "jsonl")
+        if self.format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format {self.format!r}, expected one of {OUTPUT_FORMATS}")
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, "a", newline="", encoding="utf-8")
+        self._csv = None
+        if self.format == "csv":
+            self._csv = csv.DictWriter(self._file, fieldnames=self.fields, extrasaction="ignore")
+            if new_file:
+                self._csv.writeheader()
+
+    def completed(self):
+        """Names that already have a successful row in the output"""
+        names = set()
+        with open(self.path, newline="", encoding="utf-8") as f:
+            rows = csv.DictReader(f) if self.format == "csv" else map(parse_json_row, f)
+            for row in rows:
+                if row and row.get("name") and not row.get("error"):
+                    names.add(row["name"])
+        return names
+
+    def write(self, row):
+        if self._csv is not None:
+            self._csv.writerow(row)
+        else:
+            self._file.write(json.dumps({field: row.get(field) for field in self.fields}) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class BatchRunner:
+    """Decode in a thread pool and keep up to ``concurrency`` analyses in flight
+
+    ``submit(image_base64)`` must return a Future resolving to an analysis
+    result dict (as returned by RealTimeAnalyzer.analyze_encoded). OpenCV
+    releases the GIL while decoding and encoding, so the ``decode_workers``
+    threads run in parallel. Decoding runs at most ``decode_ahead`` images
+    ahead of the analyses, so memory stays bounded however large the batch is.
+    """
+
+    def __init__(self, submit, fields, preprocessor, concurrency=2, decode_workers=None,
+                 decode_ahead=None):
+        self.submit = submit
+        self.fields = list(fields)
+        self.preprocessor = preprocessor
+        self.concurrency = concurrency
+        self.decode_workers = decode_workers or os.cpu_count() or 1
+        self.decode_ahead = decode_ahead or self.decode_workers * 2
+
+    def row(self, name, result):
+        row = {"name": name, "error": result.get("error")}
+        for field in self.fields:
+            row[field] = result.get(field)
+        return row
+
+    def run(self, items):
+        """Yield a result row for every item, in completion order"""
+        items = iter(items)
+        decoding = deque()
+        analyzing = {}
+        archives = {}
+        archives_lock = threading.Lock()
+
+        def open_archive(path):
+            with archives_lock:
+                if path not in archives:
+                    archives[path] = zipfile.ZipFile(path)
+                return archives[path]
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.decode_workers, thread_name_prefix="batch-decode") as pool:
+                while True:
+                    while len(decoding) < self.decode_ahead:
+                        item = next(items, None)
+                        if item is None:
+                            break
+                        decoding.append(pool.submit(prepare_item, item, self.preprocessor, open_archive))
+
+                    while decoding and len(analyzing) < self.concurrency:
+                        name, image_base64, error = decoding.popleft().result()
+                        if error:
+                            yield {"name": name, "error": error}
+                            continue
+                        analyzing[self.submit(image_base64)] = name
+
+                    if not analyzing:
+                        if not decoding:
+                            return
+                        continue
+
+                    done, _ = wait(analyzing, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        name = analyzing.pop(future)
+                        try:
+                            result = future.result() or {"error": "Analysis failed - no result"}
+                        except Exception as e:
+                            result = {"error": f"Analysis failed: {e}"}
+                        yield self.row(name, result)
+        finally:
+            for archive in archives.values():
+                archive.close()
+
+
+def run_batch(runner, items, writer=None):
+    """Run ``items`` through ``runner``, skipping names already completed in ``writer``
+
+    Yields each row after it has been written.
+    """
+    if writer is not None:
+        completed = writer.completed()
+        if completed:
+            logging.info(f"Resuming batch: skipping {len(completed)} already analysed image(s)")
+            items = [item for item in items if item[0] not in completed]
+    for row in runner.run(items):
+        if writer is not None:
+            writer.write(row)
+        yield row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze a folder, zip archive or list of images")
+    parser.add_argument("sources", nargs="+", help="image files, directories or zip archives")
+    parser.add_argument("--output", required=True, help="results file; .csv for CSV, otherwise JSONL")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default=None)
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("BATCH_CONCURRENCY", "2")),
+                        help="Ollama requests in flight")
+    parser.add_argument("--decode-workers", type=int, default=None, help="decode threads (default: CPU count)")
+    args = parser.parse_args()
+
+    # Importing the app builds the shared analyzer, cache and backend pool
+    import app
+
+    items = collect_items(args.sources)
+    writer = BatchWriter(args.output, app.FIELD_PATTERNS, args.format)
+    threads = ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="batch")
+    runner = BatchRunner(
+        lambda image_base64: threads.submit(app.analyzer.analyze_encoded, image_base64),
+        app.FIELD_PATTERNS, app.preprocessor, args.concurrency, args.decode_workers,
+    )
+
+    started = time.monotonic()
+    processed = failed = 0
+    try:
+        for row in run_batch(runner, items, writer):
+            processed += 1
+            if row.get("error"):
+                failed += 1
+                logging.warning(f"{row['name']}: {row['error']}")
+            if processed % 10 == 0:
+                logging.info(f"{processed} image(s) analysed, {failed} failed")
+    except KeyboardInterrupt:
+        logging.warning("Interrupted; rerun with the same --output to resume")
+        return 130
+    finally:
+        writer.close()
+        threads.shutdown(wait=False, cancel_futures=True)
+
+    logging.info(f"Batch finished: {processed} image(s) in {time.monotonic() - started:.1f}s, {failed} failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
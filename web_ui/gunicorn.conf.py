@@ -0,0 +1,103 @@
+"""Production serving for the scene analyzer.
+
+Run with:  gunicorn -c gunicorn.conf.py app:app
+Async:     gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi_app:app
+
+Every worker imports the app itself (no preload), so each one gets its own
+HTTP pool, caches, scheduler threads and warm-up; background threads would
+not survive a fork from a preloaded master. Image sessions must be seen by
+every worker, so with more than one worker IMAGE_STORE_PATH defaults to a
+sqlite file shared by all of them. Unless WEB_SPLIT_LIMITS=false the
+limits are for the whole server: OLLAMA_NUM_PARALLEL generations per
+backend are shared between the workers through lock files in
+OLLAMA_SLOT_DIR, and OLLAMA_MAX_INFLIGHT and SCHEDULER_MAX_QUEUE are
+divided between them. Under gthread MAX_CONCURRENT_REQUESTS defaults to
+the thread count less a couple of threads kept for /metrics. On SIGTERM
+a worker stops accepting connections, finishes its requests within
+WEB_GRACEFUL_TIMEOUT and then drains the analyses still queued.
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+bind = os.getenv("WEB_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_WORKERS", "2"))
+worker_class = os.getenv("WEB_WORKER_CLASS", "gthread")
+threads = int(os.getenv("WEB_THREADS", "16"))  # requests handled at once by each gthread worker
+timeout = int(os.getenv("WEB_TIMEOUT", "300"))  # cold generations and /batch streams are slow
+graceful_timeout = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "60"))
+keepalive = int(os.getenv("WEB_KEEPALIVE", "5"))
+backlog = int(os.getenv("WEB_BACKLOG", "256"))
+max_requests = int(os.getenv("WEB_MAX_REQUESTS", "0"))  # recycle workers after N requests, 0 = never
+max_requests_jitter = max_requests // 10
+limit_request_line = 8190
+accesslog = os.getenv("WEB_ACCESS_LOG", "-") or None
+preload_app = False
+
+SPLIT_LIMITS = os.getenv("WEB_SPLIT_LIMITS", "true").lower() in ("1", "true", "yes")
+SPLIT_LIMITS_DEFAULTS = {"OLLAMA_MAX_INFLIGHT": "8", "SCHEDULER_MAX_QUEUE": "32"}
+RESERVED_THREADS = 2  # left free for /metrics and static files when the request cap is hit
+runtime_dir = None  # image sessions, slot locks and metrics of this run, removed on exit
+
+
+def on_starting(server):
+    global runtime_dir
+    runtime_dir = tempfile.mkdtemp(prefix="scene-analyzer-")
+    if workers > 1:
+        # A chat may reach another worker than the /analyze that opened its image session
+        path = os.environ.setdefault("IMAGE_STORE_PATH", os.path.join(runtime_dir, "image_sessions.sqlite3"))
+        server.log.info(f"Image sessions shared by all workers in {path}")
+    if SPLIT_LIMITS and workers > 1:
+        directory = os.environ.setdefault("OLLAMA_SLOT_DIR", os.path.join(runtime_dir, "slots"))
+        server.log.info(f"OLLAMA_NUM_PARALLEL shared by all workers through {directory}")
+        for name, default in SPLIT_LIMITS_DEFAULTS.items():
+            total = int(os.getenv(name, default))
+            if total < workers:
+                server.log.warning(f"{name}={total} is below the {workers} workers, each worker gets 1")
+
+    # Counters and histograms of all workers are summed from files in this directory
+    directory = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(runtime_dir, "metrics"))
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.endswith(".db"):
+            os.remove(os.path.join(directory, name))
+    server.log.info(f"Prometheus multiprocess metrics in {directory}")
+
+
+def on_exit(server):
+    if runtime_dir is not None:
+        shutil.rmtree(runtime_dir, ignore_errors=True)
+
+
+def post_fork(server, worker):
+    # The app is imported after this, so its configuration sees the worker's share
+    if SPLIT_LIMITS and workers > 1:
+        for name, default in SPLIT_LIMITS_DEFAULTS.items():
+            total = int(os.getenv(name, default))
+            os.environ[name] = str(max(1, total // workers))
+    if worker_class == "gthread":
+        # A higher cap never triggers: gunicorn queues the extra connections itself
+        os.environ.setdefault("MAX_CONCURRENT_REQUESTS", str(max(1, threads - RESERVED_THREADS)))
+
+
+def serving_flask(worker):
+    # The ASGI app runs the same start-up and drain in its lifespan handler
+    app = sys.modules.get("app")
+    return app is not None and worker.wsgi is app.app
+
+
+def post_worker_init(worker):
+    if serving_flask(worker):
+        sys.modules["app"].init_worker()
+
+
+def worker_exit(server, worker):
+    if serving_flask(worker):
+        sys.modules["app"].shutdown_worker()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
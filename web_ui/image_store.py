@@ -0,0 +1,132 @@
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+class ImageStore:
+    """Bounded in-memory store of prepared image payloads keyed by session ID.
+
+    Entries expire after ``ttl`` seconds and the least recently used entry is
+    evicted once ``max_entries`` is reached. Every successful ``get`` refreshes
+    both the LRU position and the expiry of the entry.
+    """
+
+    def __init__(self, max_entries=256, ttl=1800):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, image_base64, image_id=None):
+        """Store a prepared payload and return its image ID, replacing ``image_id`` if given"""
+        image_id = image_id or uuid.uuid4().hex
+        with self._lock:
+            self._purge_expired()
+            self._entries[image_id] = (image_base64, time.monotonic() + self.ttl)
+            self._entries.move_to_end(image_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return image_id
+
+    def get(self, image_id):
+        """Return the payload for ``image_id``, or None if unknown or expired"""
+        with self._lock:
+            entry = self._entries.get(image_id)
+            if entry is None:
+                return None
+            image_base64, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[image_id]
+                return None
+            self._entries[image_id] = (image_base64, time.monotonic() + self.ttl)
+            self._entries.move_to_end(image_id)
+            return image_base64
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _purge_expired(self):
+        # Entries are kept in access order and share one TTL, so the oldest
+        # ones are always at the front.
+        now = time.monotonic()
+        while self._entries:
+            _, (_, expires_at) = next(iter(self._entries.items()))
+            if expires_at >= now:
+                break
+            self._entries.popitem(last=False)
+
+
+class SharedImageStore:
+    """ImageStore backed by a sqlite file, so every server process sees every session.
+
+    Used when several worker processes serve the app: a chat request may
+    reach a different worker than the /analyze that created its image ID.
+    Expiry and LRU eviction follow ImageStore, using the last access time.
+    A failing database is logged and treated as a miss.
+    """
+
+    def __init__(self, path, max_entries=256, ttl=1800):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            "image_id TEXT PRIMARY KEY, payload TEXT NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS images_accessed ON images (accessed)")
+        self._db.commit()
+        logging.info(f"Image sessions shared through {path}")
+
+    def put(self, image_base64, image_id=None):
+        """Store a prepared payload and return its image ID, replacing ``image_id`` if given"""
+        image_id = image_id or uuid.uuid4().hex
+        now = time.time()
+        try:
+            with self._lock:
+                self._db.execute("DELETE FROM images WHERE accessed < ?", (now - self.ttl,))
+                self._db.execute(
+                    "INSERT OR REPLACE INTO images (image_id, payload, accessed) VALUES (?, ?, ?)",
+                    (image_id, image_base64, now),
+                )
+                self._db.execute(
+                    "DELETE FROM images WHERE image_id IN ("
+                    "SELECT image_id FROM images ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+                self._db.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Failed to store image session: {e}")
+        return image_id
+
+    def get(self, image_id):
+        """Return the payload for ``image_id``, or None if unknown or expired"""
+        now = time.time()
+        try:
+            with self._lock:
+                row = self._db.execute(
+                    "SELECT payload FROM images WHERE image_id = ? AND accessed >= ?",
+                    (image_id, now - self.ttl),
+                ).fetchone()
+                if row is None:
+                    return None
+                self._db.execute("UPDATE images SET accessed = ? WHERE image_id = ?", (now, image_id))
+                self._db.commit()
+                return row[0]
+        except sqlite3.Error as e:
+            logging.error(f"Failed to read image session: {e}")
+            return None
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,134 @@
+"""Prometheus metrics for the analyze/chat pipeline.
+
+Stage latencies (decode, resize, encode, base64, queue_wait, generation)
+share one histogram labelled by stage. Ollama's own timing fields from
+each finished generation and the outcome of every Ollama attempt are
+recorded as they happen. Cache, scheduler and backend state is read from
+the components' stats() at scrape time, so their counters are not
+duplicated.
+
+Under a multi-worker server set PROMETHEUS_MULTIPROC_DIR: the histograms
+and counters are then aggregated across workers, while the component
+stats come from whichever worker answers the scrape.
+"""
+import os
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# Covers a few milliseconds of image work up to multi-minute cold generations
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+STAGE_SECONDS = Histogram(
+    "analyzer_stage_seconds", "Time spent in each stage of the analyze/chat pipeline",
+    ["stage"], buckets=LATENCY_BUCKETS,
+)
+OLLAMA_DURATION_SECONDS = Histogram(
+    "ollama_duration_seconds", "Durations reported by Ollama for finished generations",
+    ["phase"], buckets=LATENCY_BUCKETS,
+)
+OLLAMA_TOKENS = Histogram(
+    "ollama_tokens", "Tokens per finished generation as reported by Ollama",
+    ["kind"], buckets=TOKEN_BUCKETS,
+)
+OLLAMA_ATTEMPTS = Counter(
+    "ollama_attempts_total", "Ollama requests by outcome (each retry is another attempt)",
+    ["outcome"],
+)
+OLLAMA_HEDGES = Counter("ollama_hedged_requests_total", "Hedged second requests sent to another backend")
+
+# Ollama fields (nanoseconds) exported as ollama_duration_seconds phases
+DURATION_FIELDS = {
+    "total": "total_duration",
+    "load": "load_duration",
+    "prompt_eval": "prompt_eval_duration",
+    "eval": "eval_duration",
+}
+
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+def record_generation(data):
+    """Record the timing and token fields of a finished Ollama generation"""
+    for phase, field in DURATION_FIELDS.items():
+        if field in data:
+            OLLAMA_DURATION_SECONDS.labels(phase).observe(data[field] / 1e9)
+    if "prompt_eval_count" in data:
+        OLLAMA_TOKENS.labels("prompt").observe(data["prompt_eval_count"])
+    if "eval_count" in data:
+        OLLAMA_TOKENS.labels("eval").observe(data["eval_count"])
+
+
+def record_attempt(outcome):
+    """Count one Ollama attempt: success, retryable, fatal or no_backend"""
+    OLLAMA_ATTEMPTS.labels(outcome).inc()
+
+
+class PipelineCollector:
+    """Expose cache, scheduler and backend stats on each scrape"""
+
+    def __init__(self, result_cache=None, near_duplicates=None, scheduler=None, backends=None):
+        self.result_cache = result_cache
+        self.near_duplicates = near_duplicates
+        self.scheduler = scheduler
+        self.backends = backends
+
+    def collect(self):
+        lookups = CounterMetricFamily(
+            "analysis_cache_lookups", "Analysis cache lookups by tier and result", labels=["tier", "result"],
+        )
+        if self.result_cache is not None:
+            stats = self.result_cache.stats()
+            lookups.add_metric(["result", "memory_hit"], stats["memory_hits"])
+            lookups.add_metric(["result", "disk_hit"], stats["disk_hits"])
+            lookups.add_metric(["result", "miss"], stats["misses"])
+        if self.near_duplicates is not None:
+            stats = self.near_duplicates.stats()
+            lookups.add_metric(["near_duplicate", "hit"], stats["hits"])
+            lookups.add_metric(["near_duplicate", "miss"], stats["misses"])
+        yield lookups
+
+        if self.scheduler is not None:
+            stats = self.scheduler.stats()
+            yield GaugeMetricFamily("scheduler_queued_jobs", "Jobs waiting for a dispatch slot", value=stats["queued"])
+            yield GaugeMetricFamily("scheduler_running_jobs", "Jobs currently running", value=stats["running"])
+            yield CounterMetricFamily("scheduler_coalesced", "Requests that joined an in-flight analysis", value=stats["coalesced"])
+            yield CounterMetricFamily("scheduler_rejected", "Requests rejected with 429", value=stats["rejected"])
+
+        if self.backends is not None:
+            outstanding = GaugeMetricFamily("ollama_backend_outstanding", "In-flight requests per backend", labels=["backend"])
+            healthy = GaugeMetricFamily("ollama_backend_healthy", "1 if the backend passed its last probe", labels=["backend"])
+            for backend in self.backends.stats():
+                outstanding.add_metric([backend["url"]], backend["outstanding"])
+                healthy.add_metric([backend["url"]], 1 if backend["healthy"] and not backend["circuit_open"] else 0)
+            yield outstanding
+            yield healthy
+
+
+_pipeline_collector = None
+
+
+def multiprocess_enabled():
+    return bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+
+def register_collector(**components):
+    global _pipeline_collector
+    _pipeline_collector = PipelineCollector(**components)
+    if not multiprocess_enabled():
+        REGISTRY.register(_pipeline_collector)
+
+
+def render():
+    """Return (body, content_type) for a /metrics response"""
+    if not multiprocess_enabled():
+        return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    if _pipeline_collector is not None:
+        registry.register(_pipeline_collector)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,109 @@
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+HASH_BITS = 64
+
+
+def dhash(image_np):
+    """64-bit difference hash of a decoded BGR (or grayscale) image"""
+    if image_np.ndim == 3:
+        gray = cv2.cvtColor(image_np, cv2.COLOR_BGR2GRAY)
+    else:
+        gray = image_np
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class NearDuplicateIndex:
+    """Recent frame hashes indexed for Hamming-distance lookups.
+
+    Hashes are split into ``max_distance + 1`` bands. By the pigeonhole
+    principle any two hashes within ``max_distance`` bits agree exactly on
+    at least one band, so a lookup only needs to compare against entries
+    that share a band bucket. Entries expire after ``ttl`` seconds and the
+    oldest is dropped once ``max_entries`` is reached.
+    """
+
+    def __init__(self, max_distance=4, max_entries=256, ttl=30):
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        bands = max_distance + 1
+        edges = [round(i * HASH_BITS / bands) for i in range(bands + 1)]
+        self._bands = [
+            (start, (1 << (end - start)) - 1)
+            for start, end in zip(edges, edges[1:])
+        ]
+        self._entries = OrderedDict()
+        self._buckets = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def find(self, frame_hash):
+        """Return (result, distance) for the closest recent frame, or None"""
+        with self._lock:
+            self._purge_expired()
+            best = None
+            seen = set()
+            for key in self._band_keys(frame_hash):
+                for entry_id in self._buckets.get(key, ()):
+                    if entry_id in seen:
+                        continue
+                    seen.add(entry_id)
+                    stored_hash, result, _ = self._entries[entry_id]
+                    distance = hamming(frame_hash, stored_hash)
+                    if distance <= self.max_distance and (best is None or distance < best[1]):
+                        best = (result, distance)
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return dict(best[0]), best[1]
+
+    def add(self, frame_hash, result):
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (frame_hash, dict(result), time.monotonic())
+            for key in self._band_keys(frame_hash):
+                self._buckets.setdefault(key, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._evict_oldest()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+    def _band_keys(self, frame_hash):
+        return [
+            (index, (frame_hash >> start) & mask)
+            for index, (start, mask) in enumerate(self._bands)
+        ]
+
+    def _evict_oldest(self):
+        entry_id, (frame_hash, _, _) = self._entries.popitem(last=False)
+        for key in self._band_keys(frame_hash):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def _purge_expired(self):
+        cutoff = time.monotonic() - self.ttl
+        while self._entries:
+            _, (_, _, created) = next(iter(self._entries.items()))
+            if created >= cutoff:
+                break
+            self._evict_oldest()
@@ -0,0 +1,160 @@
+import base64
+import logging
+import struct
+import time
+
+import cv2
+import numpy as np
+
+RESIZE_MODES = ("stretch", "fit", "letterbox")
+
+# Reduced decode flags by downscale factor, largest first
+REDUCED_DECODE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+# JPEG start-of-frame markers carry the image dimensions
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def image_dimensions(data):
+    """Read (width, height) from a JPEG or PNG header without decoding"""
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and len(data) >= 24:
+        return struct.unpack('>II', data[16:24])
+
+    if data[:2] != b'\xff\xd8':
+        return None
+    i = 2
+    while i + 4 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9:  # markers without a payload
+            i += 2
+            continue
+        if marker in JPEG_SOF_MARKERS:
+            if i + 9 > len(data):
+                return None
+            height, width = struct.unpack('>HH', data[i + 5:i + 9])
+            return width, height
+        (length,) = struct.unpack('>H', data[i + 2:i + 4])
+        i += 2 + length
+    return None
+
+
+class ImagePreprocessor:
+    """Decode uploads and prepare the JPEG payload sent to the vision model.
+
+    ``mode`` controls how images are brought to ``size``:
+
+    - ``stretch``: squash to size x size (the original behaviour)
+    - ``fit``: keep the aspect ratio, longest side at most ``size``
+    - ``letterbox``: like fit, then pad to size x size with black borders
+
+    When ``reduced_decode`` is set, large JPEG/PNG inputs are decoded at
+    1/2, 1/4 or 1/8 scale (cv2.IMREAD_REDUCED_COLOR_*) as long as the result
+    is still at least ``size`` pixels, so the full-resolution bitmap is never
+    materialised. JPEG quality starts at ``jpeg_quality`` and, if
+    ``target_bytes`` is set, steps down until the payload fits.
+
+    ``observe(stage, seconds)``, if given, is called with the time spent in
+    each of the decode, resize, encode and base64 stages.
+    """
+
+    def __init__(self, size=512, mode="fit", jpeg_quality=85, target_bytes=0,
+                 min_jpeg_quality=40, reduced_decode=True, observe=None):
+        if mode not in RESIZE_MODES:
+            raise ValueError(f"Unknown resize mode {mode!r}, expected one of {RESIZE_MODES}")
+        self.size = size
+        self.mode = mode
+        self.jpeg_quality = jpeg_quality
+        self.target_bytes = target_bytes
+        self.min_jpeg_quality = min_jpeg_quality
+        self.reduced_decode = reduced_decode
+        self.observe = observe
+
+    def decode(self, data):
+        """Decode image bytes, returning None for unreadable data"""
+        started = time.perf_counter()
+        file_bytes = np.frombuffer(data, np.uint8)
+        flag = self._decode_flag(data)
+        img = cv2.imdecode(file_bytes, flag)
+        if img is None and flag != cv2.IMREAD_COLOR:
+            img = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
+        self._observe("decode", started)
+        return img
+
+    def resize(self, image_np):
+        started = time.perf_counter()
+        resized = self._resize(image_np)
+        self._observe("resize", started)
+        return resized
+
+    def _resize(self, image_np):
+        height, width = image_np.shape[:2]
+        if self.mode == "stretch":
+            return cv2.resize(image_np, (self.size, self.size), interpolation=self._interpolation(width, height))
+
+        scale = min(self.size / width, self.size / height, 1.0)
+        new_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        resized = image_np
+        if new_size != (width, height):
+            resized = cv2.resize(image_np, new_size, interpolation=cv2.INTER_AREA)
+        if self.mode == "fit":
+            return resized
+
+        pad_x = self.size - new_size[0]
+        pad_y = self.size - new_size[1]
+        return cv2.copyMakeBorder(
+            resized, pad_y // 2, pad_y - pad_y // 2, pad_x // 2, pad_x - pad_x // 2,
+            cv2.BORDER_CONSTANT, value=(0, 0, 0),
+        )
+
+    def encode(self, image_np):
+        """Resize and JPEG-encode an image, returning the base64 payload or None"""
+        resized = self.resize(image_np)
+        started = time.perf_counter()
+        quality = self.jpeg_quality
+        while True:
+            ok, img_encoded = cv2.imencode('.jpg', resized, [cv2.IMWRITE_JPEG_QUALITY, quality])
+            if not ok:
+                logging.error("Failed to encode image to JPEG")
+                return None
+            if not self.target_bytes or len(img_encoded) <= self.target_bytes or quality <= self.min_jpeg_quality:
+                break
+            quality = max(self.min_jpeg_quality, quality - 10)
+        self._observe("encode", started)
+
+        started = time.perf_counter()
+        image_base64 = base64.b64encode(img_encoded).decode('utf-8')
+        self._observe("base64", started)
+        return image_base64
+
+    def _observe(self, stage, started):
+        if self.observe is not None:
+            self.observe(stage, time.perf_counter() - started)
+
+    def _decode_flag(self, data):
+        if not self.reduced_decode:
+            return cv2.IMREAD_COLOR
+        dimensions = image_dimensions(data)
+        if dimensions is None:
+            return cv2.IMREAD_COLOR
+
+        # Only the dimension that ends up at ``size`` has to survive the reduction
+        width, height = dimensions
+        limiting = min(width, height) if self.mode == "stretch" else max(width, height)
+        for factor, flag in REDUCED_DECODE_FLAGS:
+            if limiting // factor >= self.size:
+                return flag
+        return cv2.IMREAD_COLOR
+
+    def _interpolation(self, width, height):
+        if width >= self.size and height >= self.size:
+            return cv2.INTER_AREA
+        return cv2.INTER_LINEAR
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def cache_key(image_base64, model, prompt):
+    """Content-addressed key for an analysis of a prepared image"""
+    digest = hashlib.sha256()
+    for part in (model, prompt, image_base64):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Two-tier cache of analysis results.
+
+    The first tier is an in-memory LRU of ``max_entries`` results. When
+    ``path`` is set, results are also written to a sqlite database so they
+    survive restarts; disk hits are promoted back into memory. Entries older
+    than ``ttl`` seconds are ignored (``ttl=None`` keeps them forever). The
+    disk tier is best-effort: database errors are logged and count as a miss
+    or a skipped write.
+    """
+
+    def __init__(self, max_entries=1024, path=None, ttl=None):
+        self.max_entries = max_entries
+        self.path = path
+        self.ttl = ttl
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            # WAL and a busy timeout let several server processes share the file
+            self._db = sqlite3.connect(path, timeout=5, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, result TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            self._db.commit()
+            logging.info(f"Result cache persisted to {path}")
+
+    def get(self, key):
+        """Return the cached result for ``key`` or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry[1]):
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return dict(entry[0])
+            if entry is not None:
+                del self._entries[key]
+
+            if self._db is not None:
+                try:
+                    row = self._db.execute(
+                        "SELECT result, created FROM results WHERE key = ?", (key,)
+                    ).fetchone()
+                except sqlite3.Error as e:
+                    logging.error(f"Result cache read failed: {e}")
+                    row = None
+                if row is not None and not self._expired(row[1]):
+                    result = json.loads(row[0])
+                    self._remember(key, result, row[1])
+                    self.disk_hits += 1
+                    return dict(result)
+
+            self.misses += 1
+            return None
+
+    def put(self, key, result):
+        """Cache a successful analysis result"""
+        created = time.time()
+        with self._lock:
+            self._remember(key, dict(result), created)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO results (key, result, created) VALUES (?, ?, ?)",
+                        (key, json.dumps(result), created),
+                    )
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logging.error(f"Result cache write failed: {e}")
+                    self._db.rollback()
+
+    def close(self):
+        """Close the persistent tier; the in-memory tier keeps working"""
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._entries),
+                "persistent": self._db is not None,
+            }
+
+    def _remember(self, key, result, created):
+        self._entries[key] = (result, created)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _expired(self, created):
+        return self.ttl is not None and time.time() - created > self.ttl
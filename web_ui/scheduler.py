@@ -0,0 +1,339 @@
+import asyncio
+import fcntl
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from contextlib import asynccontextmanager
+
+
+class SchedulerSaturated(Exception):
+    """Raised when a job cannot be queued; ``retry_after`` is in seconds"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Scheduler saturated, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class SharedSlots:
+    """A counting semaphore shared by the worker processes of one server.
+
+    Each of the ``count`` slots is an exclusive flock on its own file in
+    ``directory``. The kernel drops a dead process's locks, so a crashed
+    worker cannot leak a slot.
+    """
+
+    def __init__(self, directory, count, poll_interval=0.05):
+        os.makedirs(directory, exist_ok=True)
+        self.poll_interval = poll_interval
+        self._files = [open(os.path.join(directory, f"slot-{index}.lock"), "a") for index in range(count)]
+        self._held = set()  # flock does not exclude threads sharing a descriptor
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Wait for a free slot and return its index"""
+        while True:
+            with self._lock:
+                for index, file in enumerate(self._files):
+                    if index in self._held:
+                        continue
+                    try:
+                        fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue
+                    self._held.add(index)
+                    return index
+            time.sleep(self.poll_interval)
+
+    def release(self, index):
+        with self._lock:
+            fcntl.flock(self._files[index], fcntl.LOCK_UN)
+            self._held.discard(index)
+
+
+class AnalysisScheduler:
+    """Dispatch Ollama-bound jobs with coalescing, fairness and backpressure.
+
+    Jobs submitted with the same key while an earlier one is still queued or
+    running share its Future instead of starting another generation. The
+    remaining jobs wait in per-client queues that are served round-robin by
+    ``concurrency`` worker threads, which should match the OLLAMA_NUM_PARALLEL
+    of all Ollama backends together. Once ``max_queue`` jobs are waiting (or
+    a client has ``max_per_client`` of them), ``submit`` raises
+    SchedulerSaturated. ``observe("queue_wait", seconds)`` is called as each
+    job starts. With ``slots`` (SharedSlots) a job also holds one of them
+    while it runs, so several worker processes share the same capacity.
+    """
+
+    def __init__(self, concurrency=1, max_queue=32, max_per_client=8, observe=None, slots=None):
+        self.concurrency = concurrency
+        self.slots = slots
+        self.max_queue = max_queue
+        self.max_per_client = max_per_client
+        self.observe = observe
+        self.coalesced = 0
+        self.rejected = 0
+        self._queues = OrderedDict()
+        self._queued = 0
+        self._running = 0
+        self._inflight = {}
+        self._avg_duration = None
+        lock = threading.Lock()
+        self._cond = threading.Condition(lock)
+        self._idle = threading.Condition(lock)  # signalled when the last job finishes, for drain()
+        for index in range(concurrency):
+            threading.Thread(target=self._worker, name=f"analysis-dispatch-{index}", daemon=True).start()
+
+    def submit(self, key, client_id, fn, *args):
+        """Queue ``fn(*args)`` and return a Future for its result
+
+        A ``key`` of None disables coalescing for the job.
+        """
+        with self._cond:
+            if key is not None and key in self._inflight:
+                self.coalesced += 1
+                logging.debug("Coalesced request with an identical in-flight analysis")
+                return self._inflight[key]
+
+            client_queue = self._queues.get(client_id)
+            if self._queued >= self.max_queue or (
+                client_queue is not None and len(client_queue) >= self.max_per_client
+            ):
+                self.rejected += 1
+                raise SchedulerSaturated(self._retry_after())
+
+            future = Future()
+            if client_queue is None:
+                client_queue = self._queues[client_id] = deque()
+            client_queue.append((key, fn, args, future, time.monotonic()))
+            self._queued += 1
+            if key is not None:
+                self._inflight[key] = future
+            self._cond.notify()
+            return future
+
+    def drain(self, timeout=None):
+        """Wait until no job is queued or running; returns False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._queued or self._running:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+            return True
+
+    def stats(self):
+        with self._cond:
+            return {
+                "concurrency": self.concurrency,
+                "queued": self._queued,
+                "running": self._running,
+                "clients_waiting": len(self._queues),
+                "coalesced": self.coalesced,
+                "rejected": self.rejected,
+            }
+
+    def _retry_after(self):
+        # Estimated time for the backlog ahead of a new job to drain
+        per_job = self._avg_duration or 5.0
+        backlog = self._queued + self._running
+        return max(1, math.ceil(per_job * backlog / self.concurrency))
+
+    def _next_job(self):
+        # Take one job from the client at the head, then rotate it to the back
+        client_id, client_queue = next(iter(self._queues.items()))
+        job = client_queue.popleft()
+        if client_queue:
+            self._queues.move_to_end(client_id)
+        else:
+            del self._queues[client_id]
+        self._queued -= 1
+        return job
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._queues:
+                    self._cond.wait()
+                key, fn, args, future, queued_at = self._next_job()
+                self._running += 1
+
+            slot = self.slots.acquire() if self.slots is not None else None
+            started = time.monotonic()
+            if self.observe is not None:
+                self.observe("queue_wait", started - queued_at)
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args))
+                except Exception as e:
+                    future.set_exception(e)
+            if slot is not None:
+                self.slots.release(slot)
+            duration = time.monotonic() - started
+
+            with self._cond:
+                self._running -= 1
+                if key is not None:
+                    self._inflight.pop(key, None)
+                if self._avg_duration is None:
+                    self._avg_duration = duration
+                else:
+                    self._avg_duration = 0.8 * self._avg_duration + 0.2 * duration
+                if not self._queued and not self._running:
+                    self._idle.notify_all()
+
+
+class AsyncAnalysisScheduler:
+    """Asyncio counterpart of AnalysisScheduler for the ASGI server.
+
+    ``concurrency`` dispatch slots are handed out round-robin across
+    per-client queues. Once ``max_queue`` callers are waiting (or a client
+    has ``max_per_client`` of them) new work raises SchedulerSaturated.
+    ``run`` shares one task between identical in-flight calls and cancels
+    it once the last caller waiting for it has gone; ``slot`` holds a
+    dispatch slot for the length of a stream. Must be created inside the
+    event loop.
+    """
+
+    def __init__(self, concurrency=8, max_queue=32, max_per_client=8, observe=None):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.max_per_client = max_per_client
+        self.observe = observe
+        self.coalesced = 0
+        self.rejected = 0
+        self._queues = OrderedDict()
+        self._queued = 0
+        self._running = 0
+        self._inflight = {}
+        self._avg_duration = None
+
+    def check(self, client_id):
+        """Raise SchedulerSaturated if ``client_id`` could not queue more work right now"""
+        client_queue = self._queues.get(client_id)
+        if self._running >= self.concurrency and (
+            self._queued >= self.max_queue
+            or (client_queue is not None and len(client_queue) >= self.max_per_client)
+        ):
+            self.rejected += 1
+            raise SchedulerSaturated(self._retry_after())
+
+    async def run(self, key, client_id, fn, *args):
+        """Return ``await fn(*args)`` run in a dispatch slot
+
+        Calls with the same ``key`` while one is in flight share its result;
+        a ``key`` of None disables coalescing.
+        """
+        entry = self._inflight.get(key) if key is not None else None
+        if entry is not None:
+            self.coalesced += 1
+            logging.debug("Coalesced request with an identical in-flight analysis")
+        else:
+            ticket = self._enqueue(client_id)
+            entry = {"task": asyncio.create_task(self._run_ticket(ticket, fn, args)), "waiters": 0}
+            if key is not None:
+                self._inflight[key] = entry
+                entry["task"].add_done_callback(lambda _task: self._forget(key, entry))
+
+        entry["waiters"] += 1
+        try:
+            return await asyncio.shield(entry["task"])
+        finally:
+            entry["waiters"] -= 1
+            if not entry["waiters"] and not entry["task"].done():
+                entry["task"].cancel()  # nobody wants the result any more
+
+    @asynccontextmanager
+    async def slot(self, client_id):
+        """Hold a dispatch slot, e.g. for a whole streamed generation"""
+        ticket = self._enqueue(client_id)
+        await self._wait(ticket)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - started)
+
+    def stats(self):
+        return {
+            "concurrency": self.concurrency,
+            "queued": self._queued,
+            "running": self._running,
+            "clients_waiting": len(self._queues),
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+        }
+
+    def _enqueue(self, client_id):
+        self.check(client_id)
+        ticket = asyncio.get_running_loop().create_future()
+        ticket.client_id = client_id
+        ticket.queued_at = time.monotonic()
+        self._queues.setdefault(client_id, deque()).append(ticket)
+        self._queued += 1
+        self._grant()
+        return ticket
+
+    async def _wait(self, ticket):
+        try:
+            await ticket
+        except asyncio.CancelledError:
+            if ticket.cancelled():
+                self._discard(ticket)
+            else:
+                self._release(None)  # granted just as the caller went away
+            raise
+        if self.observe is not None:
+            self.observe("queue_wait", time.monotonic() - ticket.queued_at)
+
+    async def _run_ticket(self, ticket, fn, args):
+        await self._wait(ticket)
+        started = time.monotonic()
+        try:
+            return await fn(*args)
+        finally:
+            self._release(time.monotonic() - started)
+
+    def _grant(self):
+        # Take one waiter from the client at the head, then rotate it to the back
+        while self._running < self.concurrency and self._queues:
+            client_id, client_queue = next(iter(self._queues.items()))
+            ticket = client_queue.popleft()
+            if client_queue:
+                self._queues.move_to_end(client_id)
+            else:
+                del self._queues[client_id]
+            self._queued -= 1
+            if ticket.cancelled():
+                continue  # its caller left; _discard will not find it any more
+            self._running += 1
+            ticket.set_result(None)
+
+    def _discard(self, ticket):
+        client_queue = self._queues.get(ticket.client_id)
+        if client_queue is not None and ticket in client_queue:
+            client_queue.remove(ticket)
+            self._queued -= 1
+            if not client_queue:
+                del self._queues[ticket.client_id]
+
+    def _release(self, duration):
+        self._running -= 1
+        if duration is not None:
+            if self._avg_duration is None:
+                self._avg_duration = duration
+            else:
+                self._avg_duration = 0.8 * self._avg_duration + 0.2 * duration
+        self._grant()
+
+    def _forget(self, key, entry):
+        if self._inflight.get(key) is entry:
+            del self._inflight[key]
+
+    def _retry_after(self):
+        per_job = self._avg_duration or 5.0
+        return max(1, math.ceil(per_job * (self._queued + self._running) / self.concurrency))
@@ -1,6 +1,13 @@
 let currentStream = null;
 let currentDeviceId = null;
-let currentImageBlob = null; // Store the current image for chat
+let currentImageBlob = null; // Kept only to re-upload if the server session expires
+let currentImageId = null; // Server-side image session used for chat
+let liveSocket = null; // WebSocket for continuous (latest-frame-wins) analysis
+let liveTimer = null;
+const LIVE_FRAME_INTERVAL_MS = 500;
+// Images are downscaled in the browser before upload; the server sets the limit
+const CLIENT_MAX_DIMENSION = parseInt(document.body.dataset.clientMaxDimension, 10) || 1024;
+const UPLOAD_JPEG_QUALITY = 0.85;
 
 async function getCameras() {
     const devices = await navigator.mediaDevices.enumerateDevices();
@@ -44,43 +51,208 @@ document.getElementById('cameraSelect').onchange = async (e) => {
     await startCamera(e.target.value);
 };
 
-document.getElementById('capture').onclick = async () => {
+function scaledSize(width, height) {
+    const scale = Math.min(1, CLIENT_MAX_DIMENSION / Math.max(width, height));
+    return [Math.round(width * scale), Math.round(height * scale)];
+}
+
+function captureFrame(callback) {
     const video = document.getElementById('video');
     const canvas = document.getElementById('canvas');
-    canvas.width = video.videoWidth;
-    canvas.height = video.videoHeight;
+    [canvas.width, canvas.height] = scaledSize(video.videoWidth, video.videoHeight);
     const ctx = canvas.getContext('2d');
     ctx.drawImage(video, 0, 0, canvas.width, canvas.height);
-    canvas.toBlob(async (blob) => {
+    canvas.toBlob(callback, 'image/jpeg', UPLOAD_JPEG_QUALITY);
+}
+
+// Re-encode large uploads at CLIENT_MAX_DIMENSION; small JPEGs are sent untouched
+async function downscaleFile(file) {
+    let bitmap;
+    try {
+        bitmap = await createImageBitmap(file);
+    } catch (err) {
+        return file; // let the server report unreadable files
+    }
+    const [width, height] = scaledSize(bitmap.width, bitmap.height);
+    if (width === bitmap.width && height === bitmap.height && file.type === 'image/jpeg') {
+        bitmap.close();
+        return file;
+    }
+    const canvas = document.createElement('canvas');
+    canvas.width = width;
+    canvas.height = height;
+    canvas.getContext('2d').drawImage(bitmap, 0, 0, width, height);
+    bitmap.close();
+    return await new Promise(resolve => {
+        canvas.toBlob(blob => resolve(blob || file), 'image/jpeg', UPLOAD_JPEG_QUALITY);
+    });
+}
+
+document.getElementById('capture').onclick = async () => {
+    captureFrame(async (blob) => {
         await sendImage(blob);
-    }, 'image/jpeg');
+    });
 };
 
+// Live mode: stream frames over a WebSocket; the server only analyzes the newest one
+function startLive() {
+    const protocol = location.protocol === 'https:' ? 'wss:' : 'ws:';
+    liveSocket = new WebSocket(`${protocol}//${location.host}/ws/live`);
+    document.getElementById('liveToggle').innerText = '⏹ Stop Live Analysis';
+    document.getElementById('resultContent').innerText = 'Connecting to live analysis...';
+
+    liveSocket.onopen = () => {
+        document.getElementById('resultContent').innerText = 'Live analysis running...';
+        liveTimer = setInterval(sendLiveFrame, LIVE_FRAME_INTERVAL_MS);
+    };
+    liveSocket.onmessage = (e) => {
+        const data = JSON.parse(e.data);
+        if (data.error) {
+            document.getElementById('resultContent').innerText = 'Error: ' + data.error;
+            return;
+        }
+        currentImageId = data.image_id;
+        renderAnalysis(data, '');
+        document.getElementById('chatContainer').style.display = 'block';
+    };
+    liveSocket.onerror = () => {
+        document.getElementById('resultContent').innerText =
+            'Error: live analysis needs the async server (uvicorn asgi_app:app)';
+    };
+    liveSocket.onclose = () => stopLive();
+}
+
+function stopLive() {
+    clearInterval(liveTimer);
+    liveTimer = null;
+    if (liveSocket) {
+        const socket = liveSocket;
+        liveSocket = null;
+        socket.close();
+    }
+    document.getElementById('liveToggle').innerText = '🔴 Start Live Analysis';
+}
+
+function sendLiveFrame() {
+    // Skip this tick if the previous frame has not left the browser yet
+    if (!liveSocket || liveSocket.readyState !== WebSocket.OPEN || liveSocket.bufferedAmount > 0) {
+        return;
+    }
+    captureFrame((blob) => {
+        if (blob && liveSocket && liveSocket.readyState === WebSocket.OPEN) {
+            currentImageBlob = blob;
+            liveSocket.send(blob);
+        }
+    });
+}
+
+// Only rendered when the server offers /ws/live (the async server)
+const liveToggle = document.getElementById('liveToggle');
+if (liveToggle) {
+    liveToggle.onclick = () => {
+        if (liveSocket) {
+            stopLive();
+        } else {
+            startLive();
+        }
+    };
+}
+
 document.getElementById('imageUpload').onchange = async (e) => {
     const file = e.target.files[0];
     if (file) {
-        await sendImage(file);
+        await sendImage(await downscaleFile(file));
     }
 };
 
+const ANALYSIS_FIELDS = [
+    ['age', 'Age'],
+    ['gender', 'Gender'],
+    ['clothing', 'Clothing'],
+    ['environment', 'Environment']
+];
+
+// Read a Server-Sent Events response body, calling onEvent(event, data) per message
+async function readEventStream(res, onEvent) {
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const message = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            let event = 'message';
+            let data = '';
+            message.split('\n').forEach(line => {
+                if (line.startsWith('event: ')) {
+                    event = line.slice(7);
+                } else if (line.startsWith('data: ')) {
+                    data += line.slice(6);
+                }
+            });
+            onEvent(event, data ? JSON.parse(data) : null);
+        }
+    }
+}
+
+function renderAnalysis(fields, partialLine) {
+    const lines = ANALYSIS_FIELDS
+        .filter(([key]) => fields[key] !== undefined)
+        .map(([key, label]) => `${label}: ${fields[key]}`);
+    if (partialLine) {
+        lines.push(partialLine);
+    }
+    document.getElementById('resultContent').innerText = lines.length ? lines.join('\n') : 'Analyzing...';
+}
+
 async function sendImage(blobOrFile) {
     // Store the current image for chat functionality
     currentImageBlob = blobOrFile;
+    currentImageId = null;
     
     const formData = new FormData();
     formData.append('image', blobOrFile);
     document.getElementById('resultContent').innerText = 'Analyzing...';
     try {
-        const res = await fetch('/analyze', {
+        const res = await fetch('/analyze/stream', {
             method: 'POST',
             body: formData
         });
-        const data = await res.json();
-        if (data.error) {
+        if (!res.ok) {
+            const data = await res.json();
             document.getElementById('resultContent').innerText = 'Error: ' + data.error;
+            return;
+        }
+
+        // Show fields as soon as the model finishes each line
+        const fields = {};
+        let partialLine = '';
+        let result = null;
+        let error = null;
+        await readEventStream(res, (event, data) => {
+            if (event === 'session') {
+                currentImageId = data.image_id;
+            } else if (event === 'token') {
+                partialLine = (partialLine + data.token).split('\n').pop();
+                renderAnalysis(fields, partialLine);
+            } else if (event === 'field') {
+                fields[data.name] = data.value;
+                renderAnalysis(fields, partialLine);
+            } else if (event === 'done') {
+                result = data;
+            } else if (event === 'error') {
+                error = data.error;
+            }
+        });
+
+        if (error || !result) {
+            document.getElementById('resultContent').innerText = 'Error: ' + (error || 'Analysis ended unexpectedly');
         } else {
-            document.getElementById('resultContent').innerText =
-                `Age: ${data.age}\nGender: ${data.gender}\nClothing: ${data.clothing}\nEnvironment: ${data.environment}`;
+            renderAnalysis(result, '');
             
             // Show chat interface after successful analysis
             document.getElementById('chatContainer').style.display = 'block';
@@ -100,6 +272,7 @@ function addChatMessage(type, message) {
     messageDiv.textContent = message;
     chatMessages.appendChild(messageDiv);
     chatMessages.scrollTop = chatMessages.scrollHeight;
+    return messageDiv;
 }
 
 function clearChatMessages() {
@@ -116,38 +289,70 @@ async function sendChatMessage(message) {
     addChatMessage('user', message);
     
     // Add loading message
+    const chatMessages = document.getElementById('chatMessages');
     const loadingDiv = document.createElement('div');
     loadingDiv.className = 'chat-message loading';
     loadingDiv.textContent = 'Thinking...';
-    document.getElementById('chatMessages').appendChild(loadingDiv);
-    document.getElementById('chatMessages').scrollTop = document.getElementById('chatMessages').scrollHeight;
+    chatMessages.appendChild(loadingDiv);
+    chatMessages.scrollTop = chatMessages.scrollHeight;
     
     try {
-        const formData = new FormData();
-        formData.append('image', currentImageBlob);
-        formData.append('message', message);
-        
-        const res = await fetch('/chat', {
-            method: 'POST',
-            body: formData
-        });
-        
-        const data = await res.json();
-        
-        // Remove loading message
-        loadingDiv.remove();
-        
-        if (data.error) {
+        let res = await postChat(message, false);
+        if (res.status === 404) {
+            const data = await res.json();
+            if (data.expired) {
+                // Session was evicted on the server; send the image once more
+                res = await postChat(message, true);
+            }
+        }
+        if (!res.ok) {
+            const data = await res.json();
+            loadingDiv.remove();
             addChatMessage('ai', 'Sorry, I encountered an error: ' + data.error);
-        } else {
-            addChatMessage('ai', data.response);
+            return;
         }
+
+        // Replace the loading message with the reply as tokens arrive
+        let replyDiv = null;
+        let reply = '';
+        await readEventStream(res, (event, data) => {
+            if (event === 'session') {
+                currentImageId = data.image_id;
+            } else if (event === 'token') {
+                if (!replyDiv) {
+                    loadingDiv.remove();
+                    replyDiv = addChatMessage('ai', '');
+                }
+                reply += data.token;
+                replyDiv.textContent = reply;
+                chatMessages.scrollTop = chatMessages.scrollHeight;
+            } else if (event === 'error') {
+                loadingDiv.remove();
+                addChatMessage('ai', 'Sorry, I encountered an error: ' + data.error);
+            }
+        });
+        loadingDiv.remove();
     } catch (err) {
         loadingDiv.remove();
         addChatMessage('ai', 'Sorry, I encountered an error: ' + err.message);
     }
 }
 
+async function postChat(message, reupload) {
+    const formData = new FormData();
+    if (currentImageId && !reupload) {
+        formData.append('image_id', currentImageId);
+    } else {
+        formData.append('image', currentImageBlob);
+    }
+    formData.append('message', message);
+
+    return await fetch('/chat/stream', {
+        method: 'POST',
+        body: formData
+    });
+}
+
 // Chat event listeners
 document.getElementById('sendMessage').onclick = async () => {
     const input = document.getElementById('chatInput');
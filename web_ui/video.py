@@ -0,0 +1,232 @@
+"""Video ingestion: analyse only the frames where the scene changes.
+
+Frames are probed at ``probe_fps`` and compared with the last keyframe on
+a tiny thumbnail: a colour-histogram distance and the mean absolute
+grayscale difference, both computed with vectorised numpy. A frame whose
+change exceeds either threshold (and is at least ``min_interval`` seconds
+after the previous keyframe) becomes a keyframe, and so does a frame
+``max_interval`` seconds after the last one. Only keyframes are sent to
+the model; the results are folded into a timeline of field changes.
+
+Run with:  python video.py clip.mp4 --output timeline.json
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+THUMBNAIL_SIZE = (64, 36)
+COLOR_LEVELS = 8  # per channel, so histograms have 8**3 bins
+
+
+def color_histogram(thumbnail):
+    """Normalised joint BGR histogram of a uint8 thumbnail"""
+    quantized = (thumbnail // (256 // COLOR_LEVELS)).astype(np.int32)
+    index = (quantized[..., 0] * COLOR_LEVELS + quantized[..., 1]) * COLOR_LEVELS + quantized[..., 2]
+    counts = np.bincount(index.ravel(), minlength=COLOR_LEVELS ** 3)
+    return counts / counts.sum()
+
+
+class SceneSampler:
+    """Decide which probed frames are keyframes"""
+
+    def __init__(self, histogram_threshold=0.3, difference_threshold=0.12, min_interval=1.0, max_interval=30.0):
+        self.histogram_threshold = histogram_threshold
+        self.difference_threshold = difference_threshold
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._last_time = None
+        self._last_histogram = None
+        self._last_gray = None
+
+    def score(self, frame):
+        """Return (histogram, gray, histogram distance, mean difference) for a frame
+
+        Both distances are in [0, 1] and measured against the last keyframe.
+        """
+        thumbnail = cv2.resize(frame, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+        histogram = color_histogram(thumbnail)
+        gray = cv2.cvtColor(thumbnail, cv2.COLOR_BGR2GRAY).astype(np.int16)
+        if self._last_histogram is None:
+            return histogram, gray, 1.0, 1.0
+        distance = 0.5 * np.abs(histogram - self._last_histogram).sum()
+        difference = np.abs(gray - self._last_gray).mean() / 255
+        return histogram, gray, float(distance), float(difference)
+
+    def is_keyframe(self, frame, timestamp):
+        """Whether ``frame`` at ``timestamp`` seconds starts a new scene; returns (bool, score)"""
+        if self._last_time is not None and timestamp - self._last_time < self.min_interval:
+            return False, 0.0
+        histogram, gray, distance, difference = self.score(frame)
+        changed = distance >= self.histogram_threshold or difference >= self.difference_threshold
+        stale = self._last_time is not None and timestamp - self._last_time >= self.max_interval
+        if not (changed or stale):
+            return False, max(distance, difference)
+        self._last_time = timestamp
+        self._last_histogram = histogram
+        self._last_gray = gray
+        return True, max(distance, difference)
+
+
+def video_info(capture):
+    fps = capture.get(cv2.CAP_PROP_FPS) or 0.0
+    frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    return {
+        "fps": round(fps, 3),
+        "frames": frames,
+        "duration": round(frames / fps, 3) if fps else None,
+        "width": int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        "height": int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+    }
+
+
+def iter_keyframes(capture, sampler, probe_fps=4.0):
+    """Yield (frame_index, timestamp, frame, score) for each keyframe
+
+    Frames between probes are grabbed but never converted to images.
+    """
+    fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+    step = max(1, round(fps / probe_fps)) if probe_fps > 0 else 1
+    index = 0
+    while capture.grab():
+        if index % step == 0:
+            ok, frame = capture.retrieve()
+            if not ok:
+                break
+            timestamp = index / fps
+            keyframe, score = sampler.is_keyframe(frame, timestamp)
+            if keyframe:
+                yield index, timestamp, frame, score
+        index += 1
+
+
+class Timeline:
+    """Fold per-keyframe analyses into a list of field changes"""
+
+    def __init__(self, fields):
+        self.fields = list(fields)
+        self.state = {}
+        self.entries = []
+
+    def add(self, frame_index, timestamp, result):
+        """Record a keyframe result; returns the timeline entry if any field changed"""
+        if "error" in result:
+            return None
+        changes = {}
+        for field in self.fields:
+            value = result.get(field)
+            if not value or value == "Unknown":
+                continue  # nothing seen; keep the last known value
+            previous = self.state.get(field)
+            if previous is None or previous.strip().lower() != value.strip().lower():
+                changes[field] = {"from": previous, "to": value}
+                self.state[field] = value
+        if not changes:
+            return None
+        entry = {"time": round(timestamp, 3), "frame": frame_index, "changes": changes, "state": dict(self.state)}
+        self.entries.append(entry)
+        return entry
+
+
+def analyze_video(capture, submit, fields, sampler, probe_fps=4.0, concurrency=2):
+    """Yield NDJSON-ready events while a video is analysed
+
+    ``submit(frame)`` must return a Future resolving to an analysis result.
+    Up to ``concurrency`` keyframes are analysed at once but results are
+    applied in frame order. Emits one ``keyframe`` event per analysed
+    frame, a ``change`` event whenever a field changes, and a final
+    ``summary`` with the whole timeline.
+    """
+    info = video_info(capture)
+    timeline = Timeline(fields)
+    pending = deque()
+    keyframes = 0
+    started = time.monotonic()
+
+    def settle(job):
+        frame_index, timestamp, score, future = job
+        try:
+            result = future.result() or {"error": "Analysis failed - no result"}
+        except Exception as e:
+            result = {"error": f"Analysis failed: {e}"}
+        events = [{
+            "type": "keyframe", "time": round(timestamp, 3), "frame": frame_index,
+            "score": round(score, 3), "error": result.get("error"),
+        }]
+        entry = timeline.add(frame_index, timestamp, result)
+        if entry is not None:
+            events.append({"type": "change", **entry})
+        return events
+
+    for frame_index, timestamp, frame, score in iter_keyframes(capture, sampler, probe_fps):
+        keyframes += 1
+        pending.append((frame_index, timestamp, score, submit(frame)))
+        if len(pending) >= concurrency:
+            yield from settle(pending.popleft())
+    while pending:
+        yield from settle(pending.popleft())
+
+    yield {
+        "type": "summary",
+        "video": info,
+        "keyframes": keyframes,
+        "elapsed": round(time.monotonic() - started, 3),
+        "timeline": timeline.entries,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze a video at its scene changes")
+    parser.add_argument("video")
+    parser.add_argument("--output", default=None, help="write the summary JSON here (default: stdout)")
+    parser.add_argument("--probe-fps", type=float, default=4.0, help="frames per second checked for changes")
+    parser.add_argument("--histogram-threshold", type=float, default=0.3)
+    parser.add_argument("--difference-threshold", type=float, default=0.12)
+    parser.add_argument("--min-interval", type=float, default=1.0, help="seconds between keyframes, at least")
+    parser.add_argument("--max-interval", type=float, default=30.0, help="seconds between keyframes, at most")
+    parser.add_argument("--concurrency", type=int, default=2, help="Ollama requests in flight")
+    args = parser.parse_args()
+
+    capture = cv2.VideoCapture(args.video)
+    if not capture.isOpened():
+        logging.error(f"Cannot open video {args.video}")
+        return 1
+
+    # Importing the app builds the shared analyzer, cache and backend pool
+    import app
+
+    sampler = SceneSampler(args.histogram_threshold, args.difference_threshold, args.min_interval, args.max_interval)
+    threads = ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="video")
+    summary = None
+    try:
+        for event in analyze_video(
+            capture, lambda frame: threads.submit(app.analyzer.analyze_image, frame),
+            app.FIELD_PATTERNS, sampler, args.probe_fps, args.concurrency,
+        ):
+            if event["type"] == "change":
+                changes = ", ".join(f"{field}: {change['to']}" for field, change in event["changes"].items())
+                logging.info(f"{event['time']:8.2f}s  {changes}")
+            elif event["type"] == "summary":
+                summary = event
+    finally:
+        capture.release()
+        threads.shutdown(wait=False, cancel_futures=True)
+
+    document = json.dumps(summary, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(document)
+    else:
+        print(document)
+    logging.info(f"{summary['keyframes']} keyframe(s) analysed in {summary['elapsed']:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())